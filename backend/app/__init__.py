@@ -5,25 +5,63 @@ from flask_cors import CORS
 # Define db globally to prevent circular imports
 db = SQLAlchemy()
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__)
     app.config.from_object('config.Config')
+    if test_config:
+        # Overrides for the test suite (throwaway database, no background worker)
+        app.config.update(test_config)
     
     # Enable CORS for all domains
     CORS(app)
     
-    # Connect Database
+    # Connect Database (tuned for the configured backend)
+    from . import storage
+    storage.configure(app)
     db.init_app(app)
     
     with app.app_context():
+        storage.init_app(app)
+        
         # Import parts of our application
         from .routes import api_bp
         from . import models
+        from . import cli
+        from . import gateway
+        from . import outbox
+        from . import timing
+        from . import idempotency
+        from . import status
         
         # --- THE FIX: Register routes with '/api' prefix ---
         app.register_blueprint(api_bp, url_prefix='/api')
         
-        # Create Tables
-        db.create_all()
+        # Command line tools (flask --app run <command>)
+        cli.init_app(app)
+        
+        # Pooled (mTLS) client for the fiscal server
+        gateway.init_app(app)
+        
+        # Responses for retried (idempotent) receipt submissions
+        idempotency.init_app(app)
+        
+        # Cached device status, pushed to tills on change
+        status.init_app(app)
+        
+        # Background delivery of queued receipts to ZIMRA
+        outbox.init_app(app)
+        
+        # Optional per-request stage tracing (Server-Timing header)
+        timing.init_app(app)
+        
+        # Create Tables (and upgrade those made by earlier versions)
+        from . import schema
+        schema.upgrade(app)
+        
+        # Parse signing keys now rather than on the first sale
+        if app.config['PREWARM_SIGNING_KEYS']:
+            from .fiscal_core import warm_key_cache
+            warm_key_cache(config.device_id for config in
+                           models.DeviceConfig.query.filter_by(is_registered=True))
         
     return app
\ No newline at end of file
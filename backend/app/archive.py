@@ -0,0 +1,311 @@
+# Fiscal day archive: moves the receipts of old closed days out of the live
+# tables into one gzip-compressed JSONL file per device and day.
+# The live database keeps a sealed DayArchive row per day (counts, first and
+# last global number, chain hashes, SHA-256 of the file) next to the day's
+# FiscalDay/FiscalDayTotal rows, so reports and numbering never need the file.
+# Audits, exports and receipt lookups read archived days back transparently.
+# Only the oldest closed days of a device are archived, in order, so archived
+# receipts always precede the live ones in global number order.
+import gzip
+import hashlib
+import io
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.orm import selectinload
+
+from .models import db, DayArchive, FiscalDay, Receipt, ReceiptLine, ReceiptSubmission
+
+ARCHIVE_BATCH_SIZE = 1000
+
+RECEIPT_COLUMNS = [
+    'device_id', 'fiscal_day_no', 'global_no', 'invoice_no', 'currency',
+    'total_amount', 'tax_amount', 'previous_hash', 'receipt_hash', 'signature',
+    'date_created', 'idempotency_key', 'idempotency_fingerprint', 'key_fingerprint'
+]
+LINE_COLUMNS = [
+    'line_no', 'name', 'quantity', 'unit_price_cents', 'total_cents', 'tax_cents',
+    'tax_category', 'tax_percent'
+]
+SUBMISSION_COLUMNS = ['status', 'attempts', 'server_signature', 'last_error', 'reported_at']
+
+ArchivedReceipt = namedtuple('ArchivedReceipt', RECEIPT_COLUMNS)
+
+
+class ArchiveError(Exception):
+    """Raised when a day can't be archived or an archive file doesn't match its seal"""
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _archive_dir():
+    return current_app.config['ARCHIVE_DIR']
+
+
+def _relative_path(device_id, fiscal_day_no):
+    return os.path.join(str(device_id), f"day_{fiscal_day_no:06d}.jsonl.gz")
+
+
+def _fsync_dir(path):
+    # Makes a rename (or new entry) in the directory durable; Windows can't open directories
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# --- Writing ---
+def archivable_days(device_id, keep=None):
+    """The device's closed, not yet archived days that can be archived now, oldest first.
+
+    The newest `keep` closed days stay live, and archiving stops at the first
+    day that still has receipts waiting in the outbox.
+    """
+    keep = current_app.config['ARCHIVE_KEEP_CLOSED_DAYS'] if keep is None else keep
+    archived = {row[0] for row in db.session.query(DayArchive.fiscal_day_no).filter_by(device_id=str(device_id))}
+    closed = (FiscalDay.query
+              .filter(FiscalDay.device_id == str(device_id), FiscalDay.closed_at.isnot(None))
+              .order_by(FiscalDay.fiscal_day_no)
+              .all())
+    candidates = [day for day in closed if day.fiscal_day_no not in archived]
+    candidates = candidates[:max(0, len(candidates) - keep)] if keep else candidates
+
+    days = []
+    for day in candidates:
+        queued = (db.session.query(ReceiptSubmission.id)
+                  .join(Receipt, ReceiptSubmission.receipt_id == Receipt.id)
+                  .filter(Receipt.device_id == day.device_id, Receipt.fiscal_day_no == day.fiscal_day_no,
+                          ReceiptSubmission.status == "Queued")
+                  .first())
+        if queued:
+            break
+        days.append(day)
+    return days
+
+
+def _serialize(receipt):
+    record = {c: _plain(getattr(receipt, c)) for c in RECEIPT_COLUMNS}
+    record['lines'] = [{c: getattr(line, c) for c in LINE_COLUMNS} for line in receipt.lines]
+    submission = receipt.submission
+    record['submission'] = {c: _plain(getattr(submission, c)) for c in SUBMISSION_COLUMNS} if submission else None
+    return record
+
+
+def _day_receipts(day):
+    # Keyset batches with their lines and submission, released as they're written
+    after = 0
+    while True:
+        batch = (Receipt.query
+                 .filter(Receipt.device_id == day.device_id, Receipt.fiscal_day_no == day.fiscal_day_no,
+                         Receipt.global_no > after)
+                 .options(selectinload(Receipt.lines), selectinload(Receipt.submission))
+                 .order_by(Receipt.global_no)
+                 .limit(ARCHIVE_BATCH_SIZE)
+                 .all())
+        if not batch:
+            return
+        for receipt in batch:
+            yield receipt
+        after = batch[-1].global_no
+        for receipt in batch:
+            for line in receipt.lines:
+                db.session.expunge(line)
+            if receipt.submission is not None:
+                db.session.expunge(receipt.submission)
+            db.session.expunge(receipt)
+
+
+def archive_day(day):
+    """Writes one closed day's receipts to its file, seals it and deletes them from the live tables"""
+    if day.closed_at is None:
+        raise ArchiveError(f"Fiscal day {day.fiscal_day_no} of device {day.device_id} is still open")
+
+    relative_path = _relative_path(day.device_id, day.fiscal_day_no)
+    path = os.path.join(_archive_dir(), relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+
+    seal = DayArchive(device_id=day.device_id, fiscal_day_no=day.fiscal_day_no, path=relative_path,
+                      receipt_count=0)
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as raw:
+            # Closing the gzip stream writes its trailer; only then is the file synced
+            with gzip.GzipFile(fileobj=raw, mode='wb') as compressed, \
+                    io.TextIOWrapper(compressed, encoding='utf-8') as f:
+                for receipt in _day_receipts(day):
+                    line = json.dumps(_serialize(receipt), separators=(',', ':')) + "\n"
+                    f.write(line)
+                    digest.update(line.encode('utf-8'))
+                    if seal.receipt_count == 0:
+                        seal.first_global_no = receipt.global_no
+                        seal.first_previous_hash = receipt.previous_hash
+                        seal.first_date = receipt.date_created
+                    seal.receipt_count += 1
+                    seal.last_global_no = receipt.global_no
+                    seal.last_receipt_hash = receipt.receipt_hash
+                    seal.last_date = receipt.date_created
+            raw.flush()
+            os.fsync(raw.fileno())
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    if seal.receipt_count != (day.receipt_count or 0):
+        os.remove(tmp_path)
+        raise ArchiveError(f"Fiscal day {day.fiscal_day_no} of device {day.device_id} has "
+                           f"{seal.receipt_count} receipts but its counters say {day.receipt_count or 0}")
+    seal.content_sha256 = digest.hexdigest()
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path))
+    _fsync_dir(_archive_dir())
+
+    # Only give up the live rows once the file on disk reads back as sealed
+    try:
+        verify_day(seal)
+    except ArchiveError:
+        os.remove(path)
+        raise
+
+    # The file is safely on disk: swap the live rows for the seal in one transaction
+    receipt_ids = (db.select(Receipt.id)
+                   .where(Receipt.device_id == day.device_id, Receipt.fiscal_day_no == day.fiscal_day_no)
+                   .scalar_subquery())
+    bulk = {"synchronize_session": False}
+    try:
+        db.session.execute(db.delete(ReceiptLine).where(ReceiptLine.receipt_id.in_(receipt_ids)),
+                           execution_options=bulk)
+        db.session.execute(db.delete(ReceiptSubmission).where(ReceiptSubmission.receipt_id.in_(receipt_ids)),
+                           execution_options=bulk)
+        db.session.execute(db.delete(Receipt).where(Receipt.device_id == day.device_id,
+                                                    Receipt.fiscal_day_no == day.fiscal_day_no),
+                           execution_options=bulk)
+        db.session.add(seal)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        os.remove(path)
+        raise
+    return seal
+
+
+def archive_closed_days(device_id=None, keep=None):
+    """Archives every eligible closed day (of one device, or all). Returns one result per day."""
+    if device_id is not None:
+        device_ids = [str(device_id)]
+    else:
+        device_ids = [row[0] for row in db.session.query(FiscalDay.device_id).distinct().order_by(FiscalDay.device_id)]
+
+    results = []
+    for device in device_ids:
+        for day in archivable_days(device, keep):
+            result = {"deviceID": device, "fiscalDayNo": day.fiscal_day_no}
+            try:
+                seal = archive_day(day)
+                result.update(status="archived", receiptCount=seal.receipt_count)
+            except ArchiveError as e:
+                result.update(status="failed", message=str(e))
+                results.append(result)
+                # Later days must not be archived ahead of this one
+                break
+            results.append(result)
+    return results
+
+
+# --- Reading ---
+def _lines(seal):
+    """Yields the file's raw lines, raising ArchiveError at the end if they don't match the seal"""
+    path = os.path.join(_archive_dir(), seal.path)
+    if not os.path.exists(path):
+        raise ArchiveError(f"Archive file {seal.path} is missing")
+    digest = hashlib.sha256()
+    count = 0
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                digest.update(line.encode('utf-8'))
+                count += 1
+                yield line
+    except (OSError, EOFError, UnicodeDecodeError) as e:
+        raise ArchiveError(f"Archive file {seal.path} can't be read: {e}")
+    if digest.hexdigest() != seal.content_sha256 or count != seal.receipt_count:
+        raise ArchiveError(f"Archive file {seal.path} does not match its seal")
+
+
+def verify_day(seal):
+    """Reads the whole file once and raises ArchiveError unless it matches its seal"""
+    for _ in _lines(seal):
+        pass
+
+
+def _read_day(seal):
+    """Yields the day's receipt records. Nothing is yielded from a file that doesn't match its seal."""
+    verify_day(seal)
+    # Checked again while reading, in case the file changed in between
+    for line in _lines(seal):
+        yield json.loads(line)
+
+
+def _as_row(record):
+    values = dict(record)
+    values['date_created'] = datetime.fromisoformat(values['date_created']) if values['date_created'] else None
+    return ArchivedReceipt(*(values.get(c) for c in RECEIPT_COLUMNS))
+
+
+def iter_archived(device_id, fiscal_day_no=None, after_global_no=None, start=None, end=None):
+    """Archived receipts of a device as ArchivedReceipt rows, in global number order.
+
+    Every file involved is checked against its seal before this returns, so a
+    damaged archive raises ArchiveError before a single row is produced.
+    """
+    query = DayArchive.query.filter_by(device_id=str(device_id))
+    if fiscal_day_no is not None:
+        query = query.filter_by(fiscal_day_no=fiscal_day_no)
+    if after_global_no is not None:
+        query = query.filter(DayArchive.last_global_no > after_global_no)
+    if start is not None:
+        query = query.filter(DayArchive.last_date >= start)
+    if end is not None:
+        query = query.filter(DayArchive.first_date < end)
+    seals = query.order_by(DayArchive.fiscal_day_no).all()
+    for seal in seals:
+        verify_day(seal)
+    return _archived_rows(seals, after_global_no, start, end)
+
+
+def _archived_rows(seals, after_global_no, start, end):
+    for seal in seals:
+        for line in _lines(seal):
+            row = _as_row(json.loads(line))
+            if after_global_no is not None and row.global_no <= after_global_no:
+                continue
+            if start is not None and row.date_created < start:
+                continue
+            if end is not None and row.date_created >= end:
+                continue
+            yield row
+
+
+def archived_device_ids():
+    return [row[0] for row in db.session.query(DayArchive.device_id).distinct()]
+
+
+def find_receipt(device_id, global_no):
+    """A device's archived record (with lines and submission) for a global number, or None"""
+    # Global numbers are per device, so the device picks the one day file to read
+    seals = DayArchive.query.filter(DayArchive.device_id == str(device_id),
+                                    DayArchive.first_global_no <= global_no,
+                                    DayArchive.last_global_no >= global_no)
+    for seal in seals:
+        for record in _read_day(seal):
+            if record['global_no'] == global_no:
+                return record
+    return None
@@ -0,0 +1,106 @@
+# ASGI application for serving the API with uvicorn (see asgi.py and serve.py).
+# Regular Flask routes run on a bounded thread pool through a2wsgi. The device
+# status stream, which every till keeps open all day, is served natively on
+# the event loop instead, so idle tills cost a coroutine rather than a thread.
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+from . import create_app
+from .models import db
+from .status import get_broadcaster
+
+STATUS_STREAM_PATH = '/api/device/status/stream'
+
+
+class FiscalAsgiApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=flask_app.config['ASGI_THREADS'])
+        self.broadcaster = get_broadcaster(flask_app)
+        self.keepalive = flask_app.config['STATUS_STREAM_KEEPALIVE']
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'] == STATUS_STREAM_PATH and scope['method'] == 'GET':
+            await self._status_stream(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.flask_app.extensions['zimra_gateway'].close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _snapshot(self, device_id):
+        # Runs on a worker thread: the cache is usually warm, otherwise it reads the DB
+        with self.flask_app.app_context():
+            try:
+                return self.broadcaster.snapshot(device_id)
+            finally:
+                db.session.remove()
+
+    async def _status_stream(self, scope, receive, send):
+        """Same events as the Flask route of the same path, without holding a thread"""
+        device_id = (parse_qs(scope['query_string'].decode('latin1')).get('deviceID') or [None])[0]
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def on_change():
+            loop.call_soon_threadsafe(changed.set)
+
+        async def wait_for_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        disconnected = asyncio.ensure_future(wait_for_disconnect())
+        self.broadcaster.subscribe(on_change)
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                    # The tills are served from another origin (as flask-cors allows for the other routes)
+                    (b'access-control-allow-origin', b'*')
+                ]
+            })
+            await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+            sent = None
+            written_at = time.monotonic()
+            while not disconnected.done():
+                changed.clear()
+                etag, body = await loop.run_in_executor(None, self._snapshot, device_id)
+                chunk = None
+                if etag != sent:
+                    sent = etag
+                    chunk = f"id: {etag}\nevent: status\ndata: {json.dumps(body)}\n\n"
+                elif time.monotonic() - written_at >= self.keepalive:
+                    chunk = ": keepalive\n\n"
+                if chunk:
+                    written_at = time.monotonic()
+                    await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+
+                # Woken by this worker's changes; the timeout re-checks for other workers' changes
+                waiter = asyncio.ensure_future(changed.wait())
+                await asyncio.wait({waiter, disconnected}, timeout=self.broadcaster.ttl,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+        finally:
+            self.broadcaster.unsubscribe(on_change)
+            disconnected.cancel()
+
+
+def create_asgi_app():
+    return FiscalAsgiApp(create_app())
@@ -0,0 +1,186 @@
+# Hash-chain audit: walks a device's receipts in global number order and
+# checks every hash, every previous-hash link and every signature.
+# Rows are streamed (yield_per / server-side cursor) so memory stays flat no
+# matter how many receipts are checked, and signatures are verified in the
+# shared process pool because they don't depend on each other. Each signature
+# is checked against the key recorded for its receipt (see DeviceKey), so
+# receipts signed before a re-key still verify. Archived days are read back
+# from their files ahead of the live rows.
+from collections import deque
+
+from . import archive
+from .fiscal_core import (amount_to_cents, calculate_hash, get_crypto_pool, get_public_key,
+                          legacy_amount_cents, public_key_pem, verify_signatures)
+from .models import db, DeviceConfig, DeviceKey, Receipt
+
+AUDIT_BATCH_SIZE = 2000
+# Batches whose signatures may be in flight at once (bounds memory)
+MAX_PENDING_BATCHES = 8
+
+
+def _receipt_rows(device_id, fiscal_day_no=None, after_global_no=None, batch_size=AUDIT_BATCH_SIZE):
+    # Only the oldest days are ever archived, so they come first in global number order
+    yield from archive.iter_archived(device_id, fiscal_day_no=fiscal_day_no, after_global_no=after_global_no)
+
+    query = (db.select(Receipt.global_no, Receipt.fiscal_day_no, Receipt.total_amount,
+                       Receipt.previous_hash, Receipt.receipt_hash, Receipt.signature,
+                       Receipt.date_created, Receipt.key_fingerprint)
+             .where(Receipt.device_id == str(device_id))
+             .order_by(Receipt.global_no))
+    if fiscal_day_no is not None:
+        query = query.where(Receipt.fiscal_day_no == fiscal_day_no)
+    if after_global_no is not None:
+        query = query.where(Receipt.global_no > after_global_no)
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    try:
+        yield from result
+    finally:
+        result.close()
+
+
+class ChainAudit:
+    """Summary of one verification run; `checkpoint` is where a rerun can resume"""
+
+    def __init__(self, device_id, fiscal_day_no, checkpoint):
+        self.device_id = str(device_id)
+        self.fiscal_day_no = fiscal_day_no
+        self.checked = 0
+        self.first_global_no = None
+        self.last_global_no = None
+        self.hash_mismatches = 0
+        self.legacy_hashes = 0
+        self.link_breaks = 0
+        self.gaps = 0
+        self.bad_signatures = 0
+        self.first_break = None
+        self.checkpoint = dict(checkpoint or {})
+
+    @property
+    def ok(self):
+        return self.first_break is None
+
+    def record_break(self, global_no, reason):
+        if self.first_break is None or global_no < self.first_break['globalNo']:
+            self.first_break = {"globalNo": global_no, "reason": reason}
+
+    def to_dict(self):
+        return {
+            "deviceID": self.device_id,
+            "fiscalDayNo": self.fiscal_day_no,
+            "ok": self.ok,
+            "checked": self.checked,
+            "firstGlobalNo": self.first_global_no,
+            "lastGlobalNo": self.last_global_no,
+            "hashMismatches": self.hash_mismatches,
+            "legacyHashes": self.legacy_hashes,
+            "linkBreaks": self.link_breaks,
+            "gaps": self.gaps,
+            "badSignatures": self.bad_signatures,
+            "firstBreak": self.first_break,
+            "checkpoint": self.checkpoint or None
+        }
+
+
+def verify_chain(device_id, fiscal_day_no=None, checkpoint=None, limit=None,
+                 parallel=True, on_checkpoint=None):
+    """Verifies a device's receipts (optionally one fiscal day) in global number order.
+
+    `checkpoint` ({"globalNo", "receiptHash"}) resumes after an earlier run;
+    `limit` stops after that many receipts; `on_checkpoint` is called with the
+    new checkpoint every time a batch is fully verified.
+    """
+    audit = ChainAudit(device_id, fiscal_day_no, checkpoint)
+    signing_keys = {key.fingerprint: key.public_key.encode('utf-8')
+                    for key in DeviceKey.query.filter_by(device_id=str(device_id))}
+    current_key = None
+
+    def key_for(fingerprint):
+        nonlocal current_key
+        pem = signing_keys.get(fingerprint) if fingerprint else None
+        if pem is not None:
+            return pem
+        # Receipts from before signing keys were recorded are checked against the current key
+        if current_key is None:
+            config = DeviceConfig.query.filter_by(device_id=str(device_id)).first()
+            current_key = public_key_pem(get_public_key(device_id, config.certificate if config else None))
+        return current_key
+
+    pool = get_crypto_pool() if parallel else None
+    pending = deque()
+
+    def settle(batch_results, batch_checkpoint):
+        for result in batch_results:
+            for global_no in (result.result() if pool else result):
+                audit.bad_signatures += 1
+                audit.record_break(global_no, "signature")
+        audit.checkpoint = batch_checkpoint
+        if on_checkpoint:
+            on_checkpoint(dict(batch_checkpoint))
+
+    prev_no = audit.checkpoint.get('globalNo')
+    prev_hash = audit.checkpoint.get('receiptHash')
+    batch = []
+
+    def flush():
+        if not batch:
+            return
+        # One check per signing key in the batch (usually just one)
+        by_key = {}
+        for pem, item in batch:
+            by_key.setdefault(pem, []).append(item)
+        batch.clear()
+        batch_checkpoint = {"globalNo": prev_no, "receiptHash": prev_hash}
+        if pool:
+            pending.append(([pool.submit(verify_signatures, pem, items) for pem, items in by_key.items()],
+                            batch_checkpoint))
+            while len(pending) > MAX_PENDING_BATCHES:
+                settle(*pending.popleft())
+        else:
+            settle([verify_signatures(pem, items) for pem, items in by_key.items()], batch_checkpoint)
+
+    rows = _receipt_rows(device_id, fiscal_day_no, prev_no)
+    try:
+        for row in rows:
+            if limit is not None and audit.checked >= limit:
+                break
+            audit.checked += 1
+            if audit.first_global_no is None:
+                audit.first_global_no = row.global_no
+            audit.last_global_no = row.global_no
+
+            # 1. Recompute the hash from the stored fields
+            date_str = row.date_created.strftime("%Y%m%d%H%M%S")
+            amount_cents = amount_to_cents(row.total_amount)
+            expected = calculate_hash(device_id, row.fiscal_day_no, row.global_no, amount_cents,
+                                      row.previous_hash, date_str)
+            if expected != row.receipt_hash:
+                # Receipts issued before exact cents were hashed with the truncated amount
+                legacy_cents = legacy_amount_cents(row.total_amount)
+                if legacy_cents != amount_cents and calculate_hash(
+                        device_id, row.fiscal_day_no, row.global_no, legacy_cents,
+                        row.previous_hash, date_str) == row.receipt_hash:
+                    audit.legacy_hashes += 1
+                else:
+                    audit.hash_mismatches += 1
+                    audit.record_break(row.global_no, "hash")
+
+            # 2. Check the link to the receipt before it
+            if prev_no is not None and row.global_no != prev_no + 1:
+                audit.gaps += 1
+                audit.record_break(row.global_no, "gap")
+            if prev_hash is not None and row.previous_hash != prev_hash:
+                audit.link_breaks += 1
+                audit.record_break(row.global_no, "previous_hash")
+
+            # 3. Queue the signature check
+            batch.append((key_for(row.key_fingerprint), (row.global_no, row.receipt_hash, row.signature)))
+            prev_no, prev_hash = row.global_no, row.receipt_hash
+            if len(batch) >= AUDIT_BATCH_SIZE:
+                flush()
+    finally:
+        rows.close()
+
+    flush()
+    while pending:
+        settle(*pending.popleft())
+    return audit
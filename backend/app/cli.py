@@ -0,0 +1,109 @@
+# Command line tools, run with e.g. `flask --app run audit-chain --device 72000003`
+import csv
+import json
+import os
+
+import click
+
+from . import archive, audit, export, provisioning
+
+
+def init_app(app):
+    app.cli.add_command(audit_chain_command)
+    app.cli.add_command(export_receipts_command)
+    app.cli.add_command(provision_devices_command)
+    app.cli.add_command(archive_days_command)
+
+
+@click.command('audit-chain')
+@click.option('--device', 'device_id', required=True, help='ZIMRA device ID to audit.')
+@click.option('--fiscal-day', type=int, default=None, help='Only check this fiscal day.')
+@click.option('--checkpoint', 'checkpoint_path', type=click.Path(dir_okay=False), default=None,
+              help='JSON file to resume from and to keep updated while running.')
+@click.option('--serial', is_flag=True, help='Verify signatures in this process only.')
+def audit_chain_command(device_id, fiscal_day, checkpoint_path, serial):
+    """Verifies hashes, hash links and signatures of a device's receipts."""
+    checkpoint = None
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        click.echo(f"Resuming after global number {checkpoint.get('globalNo')}")
+
+    def save_checkpoint(new_checkpoint):
+        if checkpoint_path:
+            with open(checkpoint_path, 'w') as f:
+                json.dump(new_checkpoint, f)
+
+    result = audit.verify_chain(device_id, fiscal_day_no=fiscal_day, checkpoint=checkpoint,
+                                parallel=not serial, on_checkpoint=save_checkpoint)
+    click.echo(json.dumps(result.to_dict(), indent=2))
+    if not result.ok:
+        raise SystemExit(1)
+
+
+@click.command('export-receipts')
+@click.option('--format', 'fmt', type=click.Choice(list(export.FORMATS)), default='jsonl')
+@click.option('--output', required=True, type=click.Path(dir_okay=False), help="File to write ('-' for stdout).")
+@click.option('--device', 'device_id', default=None, help='Only this ZIMRA device ID.')
+@click.option('--from', 'date_from', default=None, help='Start date/time (ISO).')
+@click.option('--to', 'date_to', default=None, help='End date/time (ISO); a bare date includes that day.')
+@click.option('--fiscal-day', type=int, default=None, help='Only this fiscal day.')
+def export_receipts_command(fmt, output, device_id, date_from, date_to, fiscal_day):
+    """Streams receipts to a JSONL, CSV or Parquet file."""
+    try:
+        start, end = export.parse_range(date_from, date_to)
+        rows = export.receipt_rows(device_id=device_id, start=start, end=end, fiscal_day_no=fiscal_day)
+        if fmt == 'parquet':
+            count = export.write_parquet(rows, output)
+            click.echo(f"Wrote {count} receipts to {output}", err=True)
+        else:
+            with click.open_file(output, 'w', encoding='utf-8') as out:
+                export.write_text(rows, fmt, out)
+    except (export.ExportError, archive.ArchiveError) as e:
+        raise click.ClickException(str(e))
+
+
+@click.command('provision-devices')
+@click.argument('devices_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--force', is_flag=True, help='Re-key and re-register devices that are already registered.')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Also write the results as JSON here.')
+def provision_devices_command(devices_path, force, output):
+    """Registers every device listed in a CSV or JSON file with ZIMRA.
+
+    Rows need a serialNumber and optionally a deviceID (looked up when
+    missing). Run it again with the same file to retry failed devices.
+    """
+    with open(devices_path, newline='') as f:
+        if devices_path.lower().endswith('.json'):
+            devices = json.load(f)
+        else:
+            devices = list(csv.DictReader(f))
+    try:
+        results = provisioning.provision_devices(devices, force=force)
+    except provisioning.ProvisioningError as e:
+        raise click.ClickException(str(e))
+
+    for result in results:
+        click.echo(f"{result['serialNumber']:<24} {result['deviceID'] or '-':<12} {result['status']:<10} {result['message']}")
+    counts = provisioning.summarize(results)
+    click.echo(f"{counts['registered']} registered, {counts['skipped']} skipped, {counts['failed']} failed")
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if counts['failed']:
+        raise SystemExit(1)
+
+
+@click.command('archive-days')
+@click.option('--device', 'device_id', default=None, help='Only this ZIMRA device ID (default: all).')
+@click.option('--keep', type=int, default=None, help='Most recent closed days to leave live (default: ARCHIVE_KEEP_CLOSED_DAYS).')
+def archive_days_command(device_id, keep):
+    """Moves the receipts of closed fiscal days into sealed archive files."""
+    results = archive.archive_closed_days(device_id=device_id, keep=keep)
+    for result in results:
+        detail = f"{result['receiptCount']} receipts" if result['status'] == 'archived' else result['message']
+        click.echo(f"{result['deviceID']:<12} day {result['fiscalDayNo']:<6} {result['status']:<9} {detail}")
+    if not results:
+        click.echo("Nothing to archive")
+    if any(r['status'] == 'failed' for r in results):
+        raise SystemExit(1)
@@ -5,3 +5,18 @@ class TaxCategory(str, Enum):
     STANDARD = 'STANDARD'
     ZERO_RATED = 'ZERO_RATED'
     EXEMPT = 'EXEMPT'
+
+
+# Tax percentage applied for each category (None: outside the scope of VAT)
+TAX_PERCENT = {
+    TaxCategory.STANDARD: 15,
+    TaxCategory.ZERO_RATED: 0,
+    TaxCategory.EXEMPT: None,
+}
+
+# taxID reported to ZIMRA for each category
+TAX_ID = {
+    TaxCategory.STANDARD: 1,
+    TaxCategory.ZERO_RATED: 2,
+    TaxCategory.EXEMPT: 3,
+}
@@ -0,0 +1,155 @@
+# Receipt export for tax reporting.
+# Rows are streamed from the database in fixed-size batches and written out as
+# they arrive, so memory stays bounded however large the requested range is.
+# JSONL and CSV are produced as text chunks (for chunked HTTP responses or
+# files); Parquet is a columnar archive format and needs pyarrow installed.
+# Receipts of archived fiscal days are read back from their day files.
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from . import archive
+from .models import db, Receipt
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = [
+    'device_id', 'fiscal_day_no', 'global_no', 'invoice_no', 'currency',
+    'total_amount', 'tax_amount', 'previous_hash', 'receipt_hash', 'signature',
+    'date_created'
+]
+
+FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+
+class ExportError(Exception):
+    """Raised for export requests that can't be served (bad filters, missing pyarrow)"""
+
+
+def parse_range(date_from=None, date_to=None):
+    """Parses ISO dates/datetimes; a bare `date_to` date includes that whole day"""
+    try:
+        start = datetime.fromisoformat(date_from) if date_from else None
+        end = datetime.fromisoformat(date_to) if date_to else None
+    except ValueError:
+        raise ExportError("Dates must be ISO formatted, e.g. 2024-03-31")
+    if end is not None and len(date_to) == 10:
+        end += timedelta(days=1)
+    return start, end
+
+
+def receipt_rows(device_id=None, start=None, end=None, fiscal_day_no=None, batch_size=EXPORT_BATCH_SIZE):
+    """Streams receipts as plain rows in (device, global number) order.
+
+    The archive files in range are checked before this returns, so a damaged
+    one raises archive.ArchiveError instead of cutting the export short.
+    """
+    if device_id is not None:
+        device_ids = [str(device_id)]
+    else:
+        live = db.session.execute(db.select(Receipt.device_id).distinct()).scalars()
+        device_ids = sorted(set(live) | set(archive.archived_device_ids()))
+
+    archived = [archive.iter_archived(device, fiscal_day_no=fiscal_day_no, start=start, end=end)
+                for device in device_ids]
+    return _rows(device_ids, archived, start, end, fiscal_day_no, batch_size)
+
+
+def _rows(device_ids, archived, start, end, fiscal_day_no, batch_size):
+    for device, archived_rows in zip(device_ids, archived):
+        # A device's archived days all precede its live receipts
+        for row in archived_rows:
+            yield tuple(getattr(row, c) for c in EXPORT_COLUMNS)
+        yield from _live_rows(device, start, end, fiscal_day_no, batch_size)
+
+
+def _live_rows(device_id, start, end, fiscal_day_no, batch_size):
+    query = (db.select(*[getattr(Receipt, c) for c in EXPORT_COLUMNS])
+             .where(Receipt.device_id == device_id))
+    if fiscal_day_no is not None:
+        query = query.where(Receipt.fiscal_day_no == fiscal_day_no)
+    if start is not None:
+        query = query.where(Receipt.date_created >= start)
+    if end is not None:
+        query = query.where(Receipt.date_created < end)
+    query = query.order_by(Receipt.global_no)
+
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    try:
+        for row in result:
+            yield row
+    finally:
+        result.close()
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def iter_jsonl(rows, batch_size=EXPORT_BATCH_SIZE):
+    """One JSON object per line, yielded in chunks of `batch_size` receipts"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({c: _plain(v) for c, v in zip(EXPORT_COLUMNS, row)}))
+        if len(lines) >= batch_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def iter_csv(rows, batch_size=EXPORT_BATCH_SIZE):
+    """CSV with a header row, yielded in chunks of `batch_size` receipts"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow([_plain(v) for v in row])
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_parquet(rows, path, batch_size=EXPORT_BATCH_SIZE * 10):
+    """Writes a compressed columnar archive, one row group per `batch_size` receipts"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    schema = pa.schema([
+        ('device_id', pa.string()), ('fiscal_day_no', pa.int32()), ('global_no', pa.int64()),
+        ('invoice_no', pa.string()), ('currency', pa.string()), ('total_amount', pa.float64()),
+        ('tax_amount', pa.float64()), ('previous_hash', pa.string()), ('receipt_hash', pa.string()),
+        ('signature', pa.string()), ('date_created', pa.timestamp('us'))
+    ])
+    count = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        columns = [[] for _ in EXPORT_COLUMNS]
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+            count += 1
+            if len(columns[0]) >= batch_size:
+                writer.write_table(pa.table(columns, schema=schema))
+                columns = [[] for _ in EXPORT_COLUMNS]
+        if columns[0] or count == 0:
+            writer.write_table(pa.table(columns, schema=schema))
+    return count
+
+
+def write_text(rows, fmt, out):
+    """Writes JSONL or CSV to an open text file as the rows stream in"""
+    chunks = iter_jsonl(rows) if fmt == 'jsonl' else iter_csv(rows)
+    for chunk in chunks:
+        out.write(chunk)
@@ -1,9 +1,13 @@
 import os
 import hashlib
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
 import base64
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography import x509
+from cryptography.exceptions import InvalidSignature
 from cryptography.x509.oid import NameOID
 
 # Ensure keys directory exists
@@ -11,29 +15,115 @@ KEYS_DIR = os.path.join(os.getcwd(), 'keys')
 if not os.path.exists(KEYS_DIR):
     os.makedirs(KEYS_DIR)
 
+# Batches at least this large are signed across a pool of worker processes
+BULK_SIGN_PROCESS_THRESHOLD = 256
+BULK_SIGN_CHUNK_SIZE = 64
+
+# Process-wide cache of parsed private keys, keyed by device id.
+# Parsing the PEM on every receipt is costly, so keys are loaded once. Each
+# entry remembers the stamp of the file it was read from and get_private_key
+# re-checks it, so a key rotated by another worker process is picked up on
+# the next signature instead of signing with the rotated-out key. The entry
+# also holds the public key's fingerprint, recorded on every receipt it signs.
+_key_cache = {}
+_key_cache_lock = threading.Lock()
+
+def file_stamp(path):
+    """Identity of a file's current contents (None if it doesn't exist)"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def write_file_atomic(path, data):
+    """Replaces a file in one step so no process ever reads a half-written one"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    # A new inode each time, so the stamp changes even within the mtime resolution
+    os.replace(tmp_path, path)
+
 def generate_device_keys(device_id):
     """Generates ECC secp256r1 keys required by ZIMRA"""
     private_key = ec.generate_private_key(ec.SECP256R1())
     
     # Save Key
-    key_path = os.path.join(KEYS_DIR, f'device_{device_id}_private.pem')
-    with open(key_path, "wb") as f:
-        f.write(private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.TraditionalOpenSSL,
-            encryption_algorithm=serialization.NoEncryption()
-        ))
+    key_path = get_private_key_path(device_id)
+    write_file_atomic(key_path, private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption()
+    ))
+    
+    # Rotate the cached key so the next receipt is signed with the new one
+    with _key_cache_lock:
+        _key_cache[str(device_id)] = (file_stamp(key_path), private_key,
+                                      public_key_fingerprint(private_key.public_key()))
     return key_path, private_key
 
+def get_private_key_path(device_id):
+    """Where a device's PEM private key lives inside KEYS_DIR"""
+    return os.path.join(KEYS_DIR, f'device_{device_id}_private.pem')
+
 def get_private_key(device_id):
-    """Loads the private key from disk"""
-    key_path = os.path.join(KEYS_DIR, f'device_{device_id}_private.pem')
+    """Returns the device private key, (re)loading it when the file on disk changed"""
+    return get_signing_key(device_id)[0]
+
+def get_signing_key(device_id):
+    """Returns (private key, public key fingerprint), reloaded when the file on disk changed"""
+    key_path = get_private_key_path(device_id)
+    stamp = file_stamp(key_path)
+    entry = _key_cache.get(str(device_id))
+    if entry is not None and entry[0] == stamp:
+        return entry[1:]
+    
+    with _key_cache_lock:
+        entry = _key_cache.get(str(device_id))
+        if entry is None or entry[0] != stamp:
+            private_key = _load_private_key(device_id)
+            entry = (stamp, private_key, public_key_fingerprint(private_key.public_key()))
+            _key_cache[str(device_id)] = entry
+        return entry[1:]
+
+def public_key_pem(public_key):
+    return public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+def public_key_fingerprint(public_key):
+    """SHA-256 (hex) of a public key, identifying the key a receipt was signed with"""
+    der = public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return hashlib.sha256(der).hexdigest()
+
+def _load_private_key(device_id):
+    key_path = get_private_key_path(device_id)
     if not os.path.exists(key_path):
         raise Exception(f"Private Key not found for Device {device_id}. Please register first.")
         
     with open(key_path, "rb") as f:
         return serialization.load_pem_private_key(f.read(), password=None)
 
+def invalidate_private_key(device_id=None):
+    """Drops a cached key (or every cached key) so it is re-read from disk"""
+    with _key_cache_lock:
+        if device_id is None:
+            _key_cache.clear()
+        else:
+            _key_cache.pop(str(device_id), None)
+
+def warm_key_cache(device_ids):
+    """Pre-loads keys so the first sale after startup doesn't pay the load cost"""
+    for device_id in device_ids:
+        try:
+            get_private_key(device_id)
+        except Exception as e:
+            print(f"Key Cache Warning: {e}")
+
 def generate_csr(device_id, serial_no, private_key):
     """Generates the CSR for registration"""
     # ZIMRA Requirement: CN must be ZIMRA-<Serial>-<DeviceID>
@@ -47,13 +137,13 @@ def generate_csr(device_id, serial_no, private_key):
     
     return csr.public_bytes(serialization.Encoding.PEM).decode('utf-8')
 
-def calculate_hash(device_id, fiscal_day, global_no, amount, prev_hash, date_str):
+def calculate_hash(device_id, fiscal_day, global_no, amount_cents, prev_hash, date_str):
     """
     Creates the SHA-256 Hash.
-    Format: DeviceID + FiscalDay + GlobalNo + Date + Amount + PrevHash
+    Format: DeviceID + FiscalDay + GlobalNo + Date + AmountCents + PrevHash
     """
-    # ZIMRA often requires amounts in cents (integers)
-    amount_cents = int(amount * 100) 
+    # ZIMRA often requires amounts in cents (integers); pass them exact, never via a float
+    amount_cents = int(amount_cents)
     
     # The Data String
     data_string = f"{device_id}{fiscal_day}{global_no}{date_str}{amount_cents}{prev_hash}"
@@ -64,13 +154,110 @@ def calculate_hash(device_id, fiscal_day, global_no, amount, prev_hash, date_str
     # Return Base64 encoded hash
     return base64.b64encode(digest).decode('utf-8')
 
-def sign_receipt(device_id, receipt_hash):
-    """Signs the receipt hash with the Private Key"""
-    private_key = get_private_key(device_id)
+def amount_to_cents(amount):
+    """Exact cents of a stored float amount (0.29 -> 29, where int(0.29 * 100) gives 28)"""
+    return int(round(amount * 100))
+
+def legacy_amount_cents(amount):
+    """Cents as receipts issued before exact cents were hashed (truncated float)"""
+    return int(amount * 100)
+
+def calculate_day_hash(device_id, fiscal_day, date_str, counters):
+    """
+    Creates the SHA-256 Hash of a fiscal day (Z-Report).
+    Format: DeviceID + FiscalDay + Date + Counters, where every counter is
+    Currency + TaxCategory + ReceiptCount + SalesCents + TaxCents
+    """
+    counters_string = "".join(
+        f"{c['currency']}{c['tax_category']}{c['receipt_count']}{c['sales_cents']}{c['tax_cents']}"
+        for c in counters
+    )
+    data_string = f"{device_id}{fiscal_day}{date_str}{counters_string}"
+    digest = hashlib.sha256(data_string.encode('utf-8')).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+def sign_receipt(device_id, receipt_hash, private_key=None):
+    """Signs the receipt hash with the Private Key (the device's current one unless given)"""
+    private_key = private_key or get_private_key(device_id)
     
     signature = private_key.sign(
         receipt_hash.encode('utf-8'),
         ec.ECDSA(hashes.SHA256())
     )
     
-    return base64.b64encode(signature).decode('utf-8')
\ No newline at end of file
+    return base64.b64encode(signature).decode('utf-8')
+
+_crypto_pool = None
+_crypto_pool_lock = threading.Lock()
+# Parsed keys inside a worker process, keyed by their PEM bytes
+_worker_keys = {}
+
+def get_crypto_pool():
+    """Shared process pool for bulk signing and signature verification"""
+    global _crypto_pool
+    with _crypto_pool_lock:
+        if _crypto_pool is None:
+            # The pool is created lazily from a threaded server, and forking a process
+            # whose other threads hold locks (logging, the DB pool, OpenSSL) can deadlock
+            # the child. Workers come from a clean forkserver instead (spawn on Windows).
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['app.fiscal_core'])
+            else:
+                context = multiprocessing.get_context('spawn')
+            _crypto_pool = ProcessPoolExecutor(mp_context=context)
+        return _crypto_pool
+
+def _sign_chunk(key_pem, receipt_hashes):
+    private_key = _worker_keys.get(key_pem)
+    if private_key is None:
+        private_key = serialization.load_pem_private_key(key_pem, password=None)
+        _worker_keys[key_pem] = private_key
+    return [
+        base64.b64encode(private_key.sign(h.encode('utf-8'), ec.ECDSA(hashes.SHA256()))).decode('utf-8')
+        for h in receipt_hashes
+    ]
+
+def sign_receipts(device_id, receipt_hashes, private_key=None):
+    """Signs many receipt hashes, in order, using worker processes for big batches"""
+    private_key = private_key or get_private_key(device_id)
+    if len(receipt_hashes) < BULK_SIGN_PROCESS_THRESHOLD:
+        return [sign_receipt(device_id, h, private_key) for h in receipt_hashes]
+    
+    # Ship the key with each chunk so workers never sign with a rotated-out key
+    key_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    chunks = [receipt_hashes[i:i + BULK_SIGN_CHUNK_SIZE]
+              for i in range(0, len(receipt_hashes), BULK_SIGN_CHUNK_SIZE)]
+    pool = get_crypto_pool()
+    signatures = []
+    for chunk_signatures in pool.map(_sign_chunk, [key_pem] * len(chunks), chunks):
+        signatures.extend(chunk_signatures)
+    return signatures
+
+def get_public_key(device_id, certificate=None):
+    """Public key for checking a device's signatures: its ZIMRA certificate, else its own key"""
+    if certificate:
+        try:
+            return x509.load_pem_x509_certificate(certificate.encode('utf-8')).public_key()
+        except ValueError:
+            pass
+    return get_private_key(device_id).public_key()
+
+def verify_signatures(public_key_pem, items):
+    """Checks (global_no, receipt_hash, signature) items; returns the global numbers that fail"""
+    public_key = _worker_keys.get(public_key_pem)
+    if public_key is None:
+        public_key = serialization.load_pem_public_key(public_key_pem)
+        _worker_keys[public_key_pem] = public_key
+    
+    failed = []
+    for global_no, receipt_hash, signature in items:
+        try:
+            public_key.verify(base64.b64decode(signature), receipt_hash.encode('utf-8'), ec.ECDSA(hashes.SHA256()))
+        except (InvalidSignature, ValueError):
+            failed.append(global_no)
+    return failed
@@ -0,0 +1,156 @@
+# Fiscal day lifecycle and running totals.
+# Every sale adds its counts and amounts to the day's FiscalDay/FiscalDayTotal
+# rows in the same commit as the Receipt, so the Z-Report at close time is
+# read straight from those rows instead of rescanning the day's receipts.
+from collections import defaultdict
+from datetime import datetime
+
+from .fiscal_core import calculate_day_hash, sign_receipt
+from .models import db, FiscalDay, FiscalDayTotal
+
+# FiscalDayTotal.tax_category for the row that totals a whole currency
+ALL_CATEGORIES = "ALL"
+
+
+class FiscalDayError(Exception):
+    """Raised when an action doesn't fit the device's open/closed fiscal day"""
+
+
+def get_fiscal_day(device_id, fiscal_day_no, create=False, lock=False):
+    """The device's FiscalDay row. `lock` holds it (SELECT ... FOR UPDATE) until the commit."""
+    query = FiscalDay.query.filter_by(device_id=str(device_id), fiscal_day_no=fiscal_day_no)
+    if lock:
+        if db.engine.dialect.name == 'sqlite':
+            # SQLite has no row locks (FOR UPDATE is dropped): taking its write lock first does the same
+            db.session.execute(db.update(FiscalDay)
+                               .where(FiscalDay.device_id == str(device_id), FiscalDay.fiscal_day_no == fiscal_day_no)
+                               .values(closed_at=FiscalDay.closed_at))
+        # Re-read under the lock: a sale or close committed by another process shows up here
+        query = query.with_for_update().populate_existing()
+    day = query.first()
+    if day is None and create:
+        # Days opened before running totals existed have no row yet
+        day = FiscalDay(device_id=str(device_id), fiscal_day_no=fiscal_day_no)
+        db.session.add(day)
+    return day
+
+
+def open_day(config, chain):
+    """Starts the next fiscal day. Runs inside sequencer.reserve(); caller commits."""
+    if chain.is_day_open:
+        raise FiscalDayError("Day already open")
+    chain.fiscal_day_no += 1
+    chain.is_day_open = True
+    config.current_fiscal_day = chain.fiscal_day_no
+    config.is_day_open = True
+
+    day = FiscalDay(device_id=config.device_id, fiscal_day_no=chain.fiscal_day_no, opened_at=datetime.now())
+    db.session.add(day)
+    return day
+
+
+def record_receipts(device_id, fiscal_day_no, drafts):
+    """Adds a batch of receipt drafts to the day's running totals (caller commits).
+
+    Each draft carries `currency`, `global_no`, `hash` and `taxes`, a mapping of
+    tax category -> (sales_cents, tax_cents).
+    """
+    # Locked until the sale commits, so the day can't be closed under it
+    day = get_fiscal_day(device_id, fiscal_day_no, create=True, lock=True)
+    if day.closed_at is not None:
+        # Closed by another worker process since this one last seeded the device
+        raise FiscalDayError("Fiscal Day is NOT Open")
+
+    # Sum the batch first so each counter row is written once
+    sums = defaultdict(lambda: [0, 0, 0])
+    for draft in drafts:
+        currency_sum = sums[(draft['currency'], ALL_CATEGORIES)]
+        currency_sum[0] += 1
+        for category, (sales_cents, tax_cents) in draft['taxes'].items():
+            category_sum = sums[(draft['currency'], category)]
+            category_sum[0] += 1
+            category_sum[1] += sales_cents
+            category_sum[2] += tax_cents
+            currency_sum[1] += sales_cents
+            currency_sum[2] += tax_cents
+
+    rows = {}
+    if day.id is not None:
+        rows = {(row.currency, row.tax_category): row
+                for row in FiscalDayTotal.query.filter_by(fiscal_day_id=day.id)}
+    for (currency, category), (count, sales_cents, tax_cents) in sums.items():
+        row = rows.get((currency, category))
+        if row is None:
+            db.session.add(FiscalDayTotal(fiscal_day=day, currency=currency, tax_category=category,
+                                          receipt_count=count, sales_cents=sales_cents, tax_cents=tax_cents))
+        else:
+            # Increment in SQL so concurrent writers can't lose each other's sales
+            row.receipt_count = FiscalDayTotal.receipt_count + count
+            row.sales_cents = FiscalDayTotal.sales_cents + sales_cents
+            row.tax_cents = FiscalDayTotal.tax_cents + tax_cents
+
+    if day.first_global_no is None:
+        day.first_global_no = drafts[0]['global_no']
+    day.last_global_no = drafts[-1]['global_no']
+    day.last_receipt_hash = drafts[-1]['hash']
+    if day.id is None:
+        day.receipt_count = len(drafts)
+    else:
+        day.receipt_count = FiscalDay.receipt_count + len(drafts)
+
+
+def close_day(config, chain):
+    """Closes the open day and signs its Z-Report. Runs inside sequencer.reserve()."""
+    if not chain.is_day_open:
+        raise FiscalDayError("Day is not open")
+    # Waits for sales other processes are still committing into the day, and keeps new ones out
+    day = get_fiscal_day(config.device_id, chain.fiscal_day_no, create=True, lock=True)
+    if day.closed_at is not None:
+        raise FiscalDayError("Day is not open")
+    db.session.flush()
+
+    day.closed_at = datetime.now()
+    opened_at = day.opened_at or day.closed_at
+    counters = _counters(day)
+    day.report_hash = calculate_day_hash(config.device_id, day.fiscal_day_no,
+                                         opened_at.strftime("%Y%m%d"), counters)
+    day.report_signature = sign_receipt(config.device_id, day.report_hash)
+
+    chain.is_day_open = False
+    config.is_day_open = False
+    return day
+
+
+def _counters(day):
+    rows = FiscalDayTotal.query.filter_by(fiscal_day_id=day.id).all()
+    return [{
+        "currency": row.currency,
+        "tax_category": row.tax_category,
+        "receipt_count": row.receipt_count,
+        "sales_cents": row.sales_cents,
+        "tax_cents": row.tax_cents
+    } for row in sorted(rows, key=lambda r: (r.currency, r.tax_category))]
+
+
+def build_report(day):
+    """The day's totals as returned to the till (X-Report while open, Z-Report once closed)"""
+    counters = _counters(day)
+    return {
+        "deviceID": day.device_id,
+        "fiscalDayNo": day.fiscal_day_no,
+        "openedAt": day.opened_at.isoformat() if day.opened_at else None,
+        "closedAt": day.closed_at.isoformat() if day.closed_at else None,
+        "receiptCount": day.receipt_count or 0,
+        "firstGlobalNo": day.first_global_no,
+        "lastGlobalNo": day.last_global_no,
+        "lastReceiptHash": day.last_receipt_hash,
+        "totals": [{
+            "currency": c['currency'],
+            "taxCategory": c['tax_category'],
+            "receiptCount": c['receipt_count'],
+            "salesAmount": c['sales_cents'] / 100,
+            "taxAmount": c['tax_cents'] / 100
+        } for c in counters],
+        "reportHash": day.report_hash,
+        "reportSignature": day.report_signature
+    }
@@ -1,11 +1,148 @@
-# Placeholder for ZIMRA gateway / mTLS communication logic.
-# In a real deployment, this module would handle outgoing requests to the
-# fiscal device/ZIMRA endpoint using client certificates from the keys folder.
+# ZIMRA gateway: every outgoing call to the fiscal server goes through here.
+# Each device gets one long-lived requests.Session so TCP/TLS connections are
+# kept alive and reused, authenticated with the device's client certificate
+# (issued by ZIMRA at registration) and its private key from the keys folder.
+# A session is rebuilt when either file changes, so a worker process keeps up
+# with keys and certificates rotated by another one.
+import os
+import threading
 
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
 
-def send_to_zimra(payload: dict) -> dict:
-    """Stubbed gateway call.
+from .fiscal_core import KEYS_DIR, file_stamp, get_private_key_path, write_file_atomic
+from .timing import stage
 
-    For now, just echoes the payload back.
-    """
-    return {'status': 'ok', 'echo': payload}
+DEVICE_HEADERS = {
+    "DeviceModelName": "LithiPos",
+    "DeviceModelVersion": "1.0"
+}
+
+
+class ZimraGateway:
+    def __init__(self, app):
+        self.device_url = app.config['ZIMRA_API_URL'].rstrip('/')
+        self.public_url = app.config['ZIMRA_PUBLIC_API_URL'].rstrip('/')
+        self.timeout = (app.config['ZIMRA_CONNECT_TIMEOUT'], app.config['ZIMRA_READ_TIMEOUT'])
+        self.pool_size = app.config['ZIMRA_POOL_SIZE']
+        self.batch_concurrency = app.config['ZIMRA_BATCH_CONCURRENCY']
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    # --- Sessions ---
+    def _new_session(self, cert=None):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(DEVICE_HEADERS)
+        session.cert = cert
+        return session
+
+    def session_for(self, device_id=None):
+        """Returns the shared session for a device (or the anonymous one for None)."""
+        key = str(device_id) if device_id is not None else None
+        stamp = self._credentials_stamp(key)
+        entry = self._sessions.get(key)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or entry[0] != self._credentials_stamp(key):
+                if entry is not None:
+                    entry[1].close()
+                session = self._new_session(self._client_cert(key))
+                # Taken after _client_cert, which may have just written the certificate
+                entry = (self._credentials_stamp(key), session)
+                self._sessions[key] = entry
+            return entry[1]
+
+    def reset_device(self, device_id):
+        """Drops a device's session, e.g. after its certificate or key changed."""
+        with self._lock:
+            entry = self._sessions.pop(str(device_id), None)
+        if entry is not None:
+            entry[1].close()
+
+    def _credentials_stamp(self, device_id):
+        if device_id is None:
+            return None
+        return (file_stamp(get_private_key_path(device_id)), file_stamp(certificate_path(device_id)))
+
+    def _client_cert(self, device_id):
+        # Only devices that ZIMRA has issued a certificate to can use mTLS
+        if device_id is None:
+            return None
+        from .models import DeviceConfig
+        config = DeviceConfig.query.filter_by(device_id=device_id).first()
+        if not config or not config.certificate:
+            return None
+        key_path = get_private_key_path(device_id)
+        if not os.path.exists(key_path):
+            return None
+
+        # requests needs the certificate on disk, next to the private key
+        return (store_certificate(device_id, config.certificate), key_path)
+
+    # --- ZIMRA Endpoints ---
+    def lookup_device_id(self, serial_no):
+        session = self.session_for()
+        with stage('upstream'):
+            return session.post(f"{self.public_url}/LookupDeviceID",
+                                json={"serialNumber": serial_no}, timeout=self.timeout)
+
+    def issue_certificate(self, device_id, csr_pem):
+        # No client certificate yet: this is the call that obtains it
+        session = self.session_for()
+        with stage('upstream'):
+            return session.post(f"{self.device_url}/IssueCertificate",
+                                json={"deviceid": int(device_id), "csr": csr_pem},
+                                timeout=self.timeout)
+
+    def submit_receipt(self, device_id, payload):
+        """Posts one receipt. `payload` may be a dict or an already-encoded JSON string."""
+        # Note: 'SubmitReciept' is the spelling in the Mock Server file provided
+        url = f"{self.device_url}/{device_id}/SubmitReciept"
+        session = self.session_for(device_id)
+        with stage('upstream'):
+            if isinstance(payload, str):
+                return session.post(url, data=payload, timeout=self.timeout,
+                                    headers={"Content-Type": "application/json"})
+            return session.post(url, json=payload, timeout=self.timeout)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for _, session in sessions.values():
+            session.close()
+
+
+def certificate_path(device_id):
+    """Where a device's ZIMRA client certificate is kept for requests, inside KEYS_DIR"""
+    return os.path.join(KEYS_DIR, f'device_{device_id}_certificate.pem')
+
+
+def store_certificate(device_id, certificate):
+    """Writes a newly issued certificate to disk, so every process's session picks it up"""
+    cert_path = certificate_path(device_id)
+    data = certificate.encode('utf-8')
+    try:
+        with open(cert_path, "rb") as f:
+            unchanged = f.read() == data
+    except FileNotFoundError:
+        unchanged = False
+    # Rewriting an unchanged file would make every other process rebuild its session
+    if not unchanged:
+        write_file_atomic(cert_path, data)
+    return cert_path
+
+
+def init_app(app):
+    gateway = ZimraGateway(app)
+    app.extensions['zimra_gateway'] = gateway
+    return gateway
+
+
+def get_gateway(app=None):
+    return (app or current_app).extensions['zimra_gateway']
@@ -0,0 +1,80 @@
+# Replay protection for receipt submission.
+# A till that timed out retries the sale with the same Idempotency-Key (or
+# clientReceiptId). The first response is kept in a bounded LRU with a TTL so
+# the retry is answered without touching the chain; the unique
+# Receipt.idempotency_key column still catches replays after eviction, a
+# restart, or when the first attempt landed on another process.
+# Every keyed receipt stores a fingerprint of its sale, so a key reused for a
+# different cart is refused instead of answered with the old receipt.
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+MAX_KEY_LENGTH = 64
+
+
+class IdempotencyConflict(ValueError):
+    """Raised when an idempotency key is reused for a different sale"""
+
+    def __init__(self, key):
+        super().__init__(f"Idempotency key {key} was already used for a different sale")
+        self.key = key
+
+
+def fingerprint(currency, bill):
+    """SHA-256 (hex) of what was sold: currency, priced lines and totals"""
+    sale = {
+        "currency": currency,
+        "lines": bill['lines'],
+        "total_cents": bill['total_cents'],
+        "tax_cents": bill['tax_cents']
+    }
+    return hashlib.sha256(json.dumps(sale, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class ReplayCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, device_id, key):
+        """The stored entry for a device's key, or None"""
+        entry_key = (str(device_id), key)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[entry_key]
+                return None
+            self._entries.move_to_end(entry_key)
+            return value
+
+    def put(self, device_id, key, value):
+        entry_key = (str(device_id), key)
+        with self._lock:
+            self._entries[entry_key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def init_app(app):
+    cache = ReplayCache(app.config['IDEMPOTENCY_CACHE_SIZE'], app.config['IDEMPOTENCY_CACHE_TTL'])
+    app.extensions['replay_cache'] = cache
+    return cache
+
+
+def get_cache(app=None):
+    return (app or current_app).extensions['replay_cache']
@@ -0,0 +1,114 @@
+# Prometheus-style metrics, served as text at /api/metrics.
+# Stage durations recorded by timing.py feed cumulative histograms, events on
+# the receipt path feed counters, and the outbox backlog is counted in the
+# database when the endpoint is scraped. Values are per process.
+import threading
+from bisect import bisect_left
+
+# Seconds: from a sub-millisecond hash up to a slow fiscal server round-trip
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        # Unlabelled counters are exported as 0 before their first event
+        self._values = {} if self.labels else {(): 0}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+
+    def observe(self, seconds, *label_values):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((values, (list(counts), total)) for values, (counts, total) in self._series.items())
+        for label_values, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = _labels(self.labels + ("le",), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram('zimra_stage_seconds',
+                          'Time spent in each receipt stage (hash, sign, db_commit, upstream).',
+                          labels=('stage',))
+RECEIPTS_ISSUED = Counter('zimra_receipts_issued_total', 'Receipts hashed, signed and committed locally.')
+RECEIPTS_REPLAYED = Counter('zimra_receipts_replayed_total',
+                            'Retried submissions answered with the original receipt.')
+SEQUENCE_CONFLICTS = Counter('zimra_sequence_conflicts_total',
+                             'Issues retried because another process took the global number.')
+UPSTREAM_RESULTS = Counter('zimra_upstream_results_total',
+                           'Outbox delivery attempts by outcome (reported, retry, rejected).',
+                           labels=('outcome',))
+
+REGISTRY = (STAGE_SECONDS, RECEIPTS_ISSUED, RECEIPTS_REPLAYED, SEQUENCE_CONFLICTS, UPSTREAM_RESULTS)
+
+
+def _outbox_lines():
+    """Receipts per delivery state, read from the outbox table at scrape time"""
+    from .models import db, ReceiptSubmission
+
+    counts = dict(db.session.query(ReceiptSubmission.status, db.func.count(ReceiptSubmission.id))
+                  .group_by(ReceiptSubmission.status).all())
+    failing = (db.session.query(db.func.count(ReceiptSubmission.id))
+               .filter(ReceiptSubmission.status == "Queued", ReceiptSubmission.attempts > 0).scalar())
+    lines = ["# HELP zimra_outbox_receipts Receipts in the outbox by server_status.",
+             "# TYPE zimra_outbox_receipts gauge"]
+    for status in ("Queued", "Reported", "Rejected"):
+        lines.append(f'zimra_outbox_receipts{{status="{status}"}} {counts.get(status, 0)}')
+    lines += ["# HELP zimra_outbox_failing_receipts Queued receipts with at least one failed delivery.",
+              "# TYPE zimra_outbox_failing_receipts gauge",
+              f"zimra_outbox_failing_receipts {failing}"]
+    return lines
+
+
+def render():
+    """The exposition text for every metric (needs an app context)"""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    lines += _outbox_lines()
+    return "\n".join(lines) + "\n"
@@ -16,6 +16,7 @@ class DeviceConfig(db.Model):
     current_fiscal_day = db.Column(db.Integer, default=0)
     is_day_open = db.Column(db.Boolean, default=False)
     last_receipt_hash = db.Column(db.String(500), default="0")
+    last_global_no = db.Column(db.Integer, default=0)
     
     # Store Details
     tax_payer_name = db.Column(db.String(100), default="Big Old Cravings & Bakeries Pvt Ltd")
@@ -25,13 +26,130 @@ class DeviceConfig(db.Model):
     address = db.Column(db.String(200), default="123 Main Street, Bulawayo")
 
 class Receipt(db.Model):
+    # Global numbers are issued per device (see sequencer.py)
+    __table_args__ = (
+        db.UniqueConstraint('device_id', 'global_no'),
+        # Retried submissions (Idempotency-Key / clientReceiptId) map to one receipt
+        db.UniqueConstraint('device_id', 'idempotency_key'),
+        # Fiscal day reports/audits and date-range exports
+        db.Index('ix_receipt_device_day_global', 'device_id', 'fiscal_day_no', 'global_no'),
+        db.Index('ix_receipt_date_created', 'date_created'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), nullable=False)
     fiscal_day_no = db.Column(db.Integer, nullable=False)
-    global_no = db.Column(db.Integer, unique=True, nullable=False)
+    global_no = db.Column(db.Integer, nullable=False)
     invoice_no = db.Column(db.String(50), nullable=False)
+    currency = db.Column(db.String(10), nullable=False, default="ZWG")
     total_amount = db.Column(db.Float, nullable=False)
     tax_amount = db.Column(db.Float, nullable=False)
     previous_hash = db.Column(db.String(500), nullable=False)
     receipt_hash = db.Column(db.String(500), nullable=False)
     signature = db.Column(db.String(1000), nullable=False)
-    date_created = db.Column(db.DateTime, default=datetime.now)
\ No newline at end of file
+    date_created = db.Column(db.DateTime, default=datetime.now)
+    idempotency_key = db.Column(db.String(64), nullable=True)
+    # SHA-256 of the sale the key was first used for (see idempotency.fingerprint)
+    idempotency_fingerprint = db.Column(db.String(64), nullable=True)
+    # Fingerprint of the device key that signed it (see DeviceKey); None before keys were tracked
+    key_fingerprint = db.Column(db.String(64), nullable=True)
+
+class DeviceKey(db.Model):
+    # Public half of every key a device has signed receipts with, so receipts signed
+    # before a re-key are still verified against the key that was in force
+    __table_args__ = (db.UniqueConstraint('device_id', 'fingerprint'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    public_key = db.Column(db.Text, nullable=False)   # PEM (SubjectPublicKeyInfo)
+    first_used_at = db.Column(db.DateTime, default=datetime.now)
+
+class ReceiptLine(db.Model):
+    # Itemized receipt lines; amounts are integer cents, unit prices and totals tax-inclusive
+    id = db.Column(db.Integer, primary_key=True)
+    receipt_id = db.Column(db.Integer, db.ForeignKey('receipt.id'), nullable=False, index=True)
+    line_no = db.Column(db.SmallInteger, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    quantity = db.Column(db.Float, nullable=False)
+    unit_price_cents = db.Column(db.Integer, nullable=False)
+    total_cents = db.Column(db.Integer, nullable=False)
+    tax_cents = db.Column(db.Integer, nullable=False)
+    tax_category = db.Column(db.String(20), nullable=False)
+    tax_percent = db.Column(db.Float, nullable=True)
+
+    receipt = db.relationship('Receipt', backref=db.backref('lines', order_by='ReceiptLine.line_no'))
+
+class FiscalDay(db.Model):
+    # Running counters for one device's fiscal day, updated in every sale's commit
+    __table_args__ = (db.UniqueConstraint('device_id', 'fiscal_day_no'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), nullable=False)
+    fiscal_day_no = db.Column(db.Integer, nullable=False)
+    opened_at = db.Column(db.DateTime, default=datetime.now)
+    closed_at = db.Column(db.DateTime, nullable=True)
+
+    receipt_count = db.Column(db.Integer, default=0)
+    first_global_no = db.Column(db.Integer, nullable=True)
+    last_global_no = db.Column(db.Integer, nullable=True)
+    last_receipt_hash = db.Column(db.String(500), nullable=True)
+
+    # Z-Report, signed by the device when the day is closed
+    report_hash = db.Column(db.String(500), nullable=True)
+    report_signature = db.Column(db.String(1000), nullable=True)
+
+    totals = db.relationship('FiscalDayTotal', backref='fiscal_day', lazy=True)
+
+class FiscalDayTotal(db.Model):
+    # Per-currency, per-tax-category totals ("ALL" = every category in that currency)
+    __table_args__ = (db.UniqueConstraint('fiscal_day_id', 'currency', 'tax_category'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    fiscal_day_id = db.Column(db.Integer, db.ForeignKey('fiscal_day.id'), nullable=False)
+    currency = db.Column(db.String(10), nullable=False)
+    tax_category = db.Column(db.String(20), nullable=False)
+    receipt_count = db.Column(db.Integer, default=0)
+    sales_cents = db.Column(db.Integer, default=0)
+    tax_cents = db.Column(db.Integer, default=0)
+
+class DayArchive(db.Model):
+    # Seal of a closed fiscal day whose receipts were moved out to a compressed file (see archive.py)
+    __table_args__ = (db.UniqueConstraint('device_id', 'fiscal_day_no'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), nullable=False)
+    fiscal_day_no = db.Column(db.Integer, nullable=False)
+    path = db.Column(db.String(300), nullable=False)   # Relative to ARCHIVE_DIR
+
+    receipt_count = db.Column(db.Integer, nullable=False)
+    first_global_no = db.Column(db.Integer, nullable=True)
+    last_global_no = db.Column(db.Integer, nullable=True)
+    first_previous_hash = db.Column(db.String(500), nullable=True)
+    last_receipt_hash = db.Column(db.String(500), nullable=True)
+    first_date = db.Column(db.DateTime, nullable=True)
+    last_date = db.Column(db.DateTime, nullable=True)
+    # SHA-256 of the uncompressed JSONL, checked whenever the file is read back
+    content_sha256 = db.Column(db.String(64), nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+
+class ReceiptSubmission(db.Model):
+    # Outbox row: one per receipt, drained in order by the worker in outbox.py
+    __table_args__ = (db.Index('ix_submission_device_status_global', 'device_id', 'status', 'global_no'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    receipt_id = db.Column(db.Integer, db.ForeignKey('receipt.id'), unique=True, nullable=False)
+    device_id = db.Column(db.String(50), nullable=False)
+    global_no = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+
+    # Delivery State: Queued -> Reported (or Rejected if ZIMRA refuses it outright)
+    status = db.Column(db.String(20), default="Queued")
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.now)
+    last_error = db.Column(db.Text, nullable=True)
+    server_signature = db.Column(db.String(1000), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    reported_at = db.Column(db.DateTime, nullable=True)
+
+    receipt = db.relationship('Receipt', backref=db.backref('submission', uselist=False))
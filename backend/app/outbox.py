@@ -0,0 +1,183 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+import requests
+
+from .gateway import get_gateway
+from .metrics import UPSTREAM_RESULTS
+from .models import db, ReceiptSubmission
+
+# HTTP statuses worth retrying. Anything else outside 2xx is a hard rejection.
+# 401/403 come from an expired or mismatched client certificate: that is the
+# device's problem, not the receipt's, so its queue pauses until it's fixed
+# (a new certificate or key rebuilds the session) instead of rejecting it all.
+RETRYABLE_STATUS = {401, 403, 408, 425, 429, 500, 502, 503, 504}
+
+
+class OutboxWorker:
+    """Background thread that reports queued receipts to ZIMRA.
+
+    Receipts are committed locally (with their ReceiptSubmission row) before the
+    cashier gets a response; this worker then delivers them per device in
+    global number order, backing off when the fiscal server is unreachable.
+    Devices are drained on their own threads (up to OUTBOX_CONCURRENCY at
+    once), so one slow or failing device never holds up the others.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.concurrency = app.config['OUTBOX_CONCURRENCY']
+        self.page_size = app.config['OUTBOX_PAGE_SIZE']
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        # Devices with a drain thread running (at most one each, which keeps their order)
+        self._active = set()
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="zimra-outbox", daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.drain()
+            except Exception as e:
+                print(f"Outbox Error: {e}")
+            self._wakeup.wait(self.app.config['OUTBOX_POLL_INTERVAL'])
+
+    def drain(self):
+        """Starts a drain thread for every device whose next submission is due (and no thread yet)."""
+        # Only the oldest queued receipt counts: a device can't send past one in backoff
+        heads = (db.session.query(ReceiptSubmission.device_id,
+                                  db.func.min(ReceiptSubmission.global_no).label('global_no'))
+                 .filter(ReceiptSubmission.status == "Queued")
+                 .group_by(ReceiptSubmission.device_id)
+                 .subquery())
+        device_ids = [row[0] for row in db.session.query(ReceiptSubmission.device_id)
+                      .join(heads, db.and_(ReceiptSubmission.device_id == heads.c.device_id,
+                                           ReceiptSubmission.global_no == heads.c.global_no))
+                      .filter(db.or_(ReceiptSubmission.next_attempt_at.is_(None),
+                                     ReceiptSubmission.next_attempt_at <= datetime.now()))]
+        db.session.close()
+        for device_id in device_ids:
+            with self._lock:
+                if device_id in self._active:
+                    continue
+                if len(self._active) >= self.concurrency:
+                    # Picked up when one of the running devices finishes
+                    return
+                self._active.add(device_id)
+            threading.Thread(target=self._run_device, args=(device_id,),
+                             name=f"zimra-outbox-{device_id}", daemon=True).start()
+
+    def _run_device(self, device_id):
+        delivered = 0
+        try:
+            with self.app.app_context():
+                delivered = self._drain_device(device_id)
+        except Exception as e:
+            print(f"Outbox Error ({device_id}): {e}")
+        finally:
+            with self._lock:
+                self._active.discard(device_id)
+        if delivered:
+            # Receipts queued while this device was busy, or devices waiting for a free slot
+            self.wake()
+
+    def _drain_device(self, device_id):
+        """Delivers a device's queue in global number order. Returns how many were sent."""
+        delivered = 0
+        after = None
+        while True:
+            query = ReceiptSubmission.query.filter_by(device_id=device_id, status="Queued")
+            if after is not None:
+                query = query.filter(ReceiptSubmission.global_no > after)
+            page = query.order_by(ReceiptSubmission.global_no).limit(self.page_size).all()
+            if not page:
+                return delivered
+            for submission in page:
+                # Never overtake a receipt that is still waiting out its backoff
+                if submission.next_attempt_at and submission.next_attempt_at > datetime.now():
+                    return delivered
+                if not self._deliver(submission):
+                    return delivered
+                delivered += 1
+                after = submission.global_no
+
+    def _deliver(self, submission):
+        """Sends one receipt. Returns False if the device queue should pause."""
+        submission.attempts += 1
+        try:
+            response = get_gateway(self.app).submit_receipt(submission.device_id, submission.payload)
+        except requests.exceptions.RequestException as e:
+            return self._retry_later(submission, str(e))
+
+        if response.status_code == 200:
+            res_json = response.json()
+            submission.status = "Reported"
+            submission.server_signature = res_json.get('receiptServerSignature', {}).get('signature', 'VERIFIED')
+            submission.reported_at = datetime.now()
+            submission.last_error = None
+            db.session.commit()
+            UPSTREAM_RESULTS.inc("reported")
+            return True
+
+        if response.status_code in RETRYABLE_STATUS:
+            return self._retry_later(submission, response.text)
+
+        print(f"ZIMRA Rejected Receipt {submission.global_no}: {response.text}")
+        submission.status = "Rejected"
+        submission.last_error = response.text
+        db.session.commit()
+        UPSTREAM_RESULTS.inc("rejected")
+        return True
+
+    def _retry_later(self, submission, error):
+        config = self.app.config
+        delay = min(config['OUTBOX_MAX_BACKOFF'],
+                    config['OUTBOX_BASE_BACKOFF'] * 2 ** (submission.attempts - 1))
+        submission.next_attempt_at = datetime.now() + timedelta(seconds=delay)
+        submission.last_error = error
+        db.session.commit()
+        UPSTREAM_RESULTS.inc("retry")
+        return False
+
+
+def init_app(app):
+    if not app.config['OUTBOX_WORKER_ENABLED']:
+        # Another process (see serve.py) delivers the queue
+        return None
+    worker = OutboxWorker(app)
+    app.extensions['outbox'] = worker
+    # Start lazily so the debug reloader's watcher process never drains the queue
+    app.before_request(worker.ensure_started)
+    return worker
+
+
+def enqueue(receipt, device_id, payload):
+    """Adds the outbox row for a receipt to the current session (caller commits)."""
+    submission = ReceiptSubmission(
+        receipt=receipt,
+        device_id=device_id,
+        global_no=receipt.global_no,
+        payload=json.dumps(payload)
+    )
+    db.session.add(submission)
+    return submission
+
+
+def notify(app):
+    worker = app.extensions.get('outbox')
+    if worker:
+        worker.wake()
@@ -0,0 +1,180 @@
+# Bulk onboarding of a branch's devices (fetch ID, generate keys, register).
+# Keys and CSRs are generated across the crypto process pool, lookups and CSRs
+# go to ZIMRA concurrently over the gateway, and every issued certificate is
+# stored in one transaction. Registered devices are skipped, so an interrupted
+# or partly failed run is resumed by simply running it again.
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from . import status
+from .fiscal_core import generate_csr, generate_device_keys, get_crypto_pool, invalidate_private_key, warm_key_cache
+from .gateway import get_gateway, store_certificate
+from .models import db, DeviceConfig
+
+
+class ProvisioningError(ValueError):
+    """Raised for a device list that can't be provisioned as given"""
+
+
+def _generate_keys(device_id, serial_no):
+    # Runs in a pool worker: writes the key into KEYS_DIR and returns the CSR
+    _, private_key = generate_device_keys(device_id)
+    return generate_csr(device_id, serial_no, private_key)
+
+
+def _upstream_error(response):
+    return f"ZIMRA returned {response.status_code}: {response.text[:200]}"
+
+
+def parse_devices(devices):
+    """Validates [{"serialNumber", "deviceID"?}] and returns them normalized"""
+    if not devices:
+        raise ProvisioningError("No devices supplied")
+    parsed, serials, device_ids = [], set(), set()
+    for n, device in enumerate(devices, start=1):
+        serial_no = str(device.get('serialNumber') or '').strip()
+        if not serial_no:
+            raise ProvisioningError(f"Device {n}: serialNumber is required")
+        if serial_no in serials:
+            raise ProvisioningError(f"Device {n}: duplicate serialNumber {serial_no}")
+        serials.add(serial_no)
+        device_id = str(device['deviceID']) if device.get('deviceID') else None
+        # Both rows would write the same key file, leaving one certificate without its key
+        if device_id in device_ids:
+            raise ProvisioningError(f"Device {n}: duplicate deviceID {device_id}")
+        if device_id:
+            device_ids.add(device_id)
+        parsed.append({"serialNumber": serial_no, "deviceID": device_id})
+    return parsed
+
+
+def provision_devices(devices, force=False):
+    """Registers many devices with ZIMRA. Returns one result per device, in order.
+
+    Each result has the deviceID, serialNumber and a status of "registered",
+    "skipped" (already registered; pass force=True to re-key it) or "failed"
+    with a message.
+    """
+    gateway = get_gateway()
+    results = parse_devices(devices)
+    workers = max(1, min(gateway.batch_concurrency, len(results)))
+
+    def fail(result, message):
+        result.update(status="failed", message=message)
+
+    # 1. Ask ZIMRA for the IDs we weren't given (or reuse those a previous run got)
+    unknown = [r for r in results if not r['deviceID']]
+    known = {c.serial_number: c.device_id for c in
+             DeviceConfig.query.filter(DeviceConfig.serial_number.in_([r['serialNumber'] for r in unknown]))}
+    for result in unknown:
+        result['deviceID'] = known.get(result['serialNumber'])
+
+    def lookup(result):
+        try:
+            response = gateway.lookup_device_id(result['serialNumber'])
+        except requests.exceptions.RequestException as e:
+            return fail(result, str(e))
+        if response.status_code != 200:
+            return fail(result, _upstream_error(response))
+        device_id = response.json().get('deviceID')
+        if not device_id:
+            return fail(result, "ZIMRA returned no deviceID")
+        result['deviceID'] = str(device_id)
+
+    lookups = [r for r in results if not r['deviceID']]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lookup, lookups))
+
+    # An ID from a lookup (or a previous run) can still clash with another row's
+    claimed = set()
+    for result in results:
+        if 'status' in result:
+            continue
+        if result['deviceID'] in claimed:
+            fail(result, f"deviceID {result['deviceID']} is already used by another device in this list")
+        claimed.add(result['deviceID'])
+
+    # Keep the IDs ZIMRA handed out (as /setup/generate-keys does), so a rerun
+    # after a failed registration reuses them instead of asking again
+    found = [r for r in lookups if 'status' not in r]
+    stored = {c.device_id for c in
+              DeviceConfig.query.filter(DeviceConfig.device_id.in_([r['deviceID'] for r in found]))}
+    for result in found:
+        if result['deviceID'] not in stored:
+            db.session.add(DeviceConfig(device_id=result['deviceID'], serial_number=result['serialNumber']))
+    if found:
+        db.session.commit()
+        status.invalidate()
+
+    # 2. Skip what a previous run already finished
+    pending = [r for r in results if 'status' not in r]
+    configs = {c.device_id: c for c in
+               DeviceConfig.query.filter(DeviceConfig.device_id.in_([r['deviceID'] for r in pending]))}
+    for result in pending:
+        config = configs.get(result['deviceID'])
+        if config and config.is_registered and not force:
+            result.update(status="skipped", message="Already registered")
+    pending = [r for r in pending if 'status' not in r]
+
+    # 3. Keys and CSRs on every core
+    pool = get_crypto_pool()
+    futures = [pool.submit(_generate_keys, r['deviceID'], r['serialNumber']) for r in pending]
+    for result, future in zip(pending, futures):
+        try:
+            result['csr'] = future.result()
+        except Exception as e:
+            fail(result, f"Key generation failed: {e}")
+        # The new key was written by a worker process: drop anything this process cached
+        invalidate_private_key(result['deviceID'])
+        gateway.reset_device(result['deviceID'])
+    pending = [r for r in pending if 'status' not in r]
+
+    # 4. Submit the CSRs concurrently
+    def register(result):
+        try:
+            response = gateway.issue_certificate(result['deviceID'], result['csr'])
+        except requests.exceptions.RequestException as e:
+            return fail(result, str(e))
+        if response.status_code != 200:
+            return fail(result, _upstream_error(response))
+        result['certificate'] = response.json().get('certificate')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(register, pending))
+
+    # 5. Store every certificate in one transaction
+    issued = [r for r in pending if 'status' not in r]
+    for result in issued:
+        config = configs.get(result['deviceID'])
+        if config is None:
+            config = DeviceConfig(device_id=result['deviceID'], serial_number=result['serialNumber'])
+            db.session.add(config)
+        config.serial_number = result['serialNumber']
+        config.certificate = result['certificate']
+        config.is_registered = True
+    db.session.commit()
+
+    for result in issued:
+        result.update(status="registered", message="Certificate issued")
+        # Every process's next session for the device picks up its new client certificate
+        if result['certificate']:
+            store_certificate(result['deviceID'], result['certificate'])
+        gateway.reset_device(result['deviceID'])
+    warm_key_cache(r['deviceID'] for r in issued)
+    if issued:
+        status.invalidate()
+
+    return [{
+        "deviceID": r['deviceID'],
+        "serialNumber": r['serialNumber'],
+        "status": r['status'],
+        "message": r['message']
+    } for r in results]
+
+
+def summarize(results):
+    counts = {"registered": 0, "skipped": 0, "failed": 0}
+    for result in results:
+        counts[result['status']] += 1
+    return counts
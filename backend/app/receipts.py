@@ -0,0 +1,304 @@
+# Issuing fiscal receipts: numbering, hashing, signing and staging them for
+# the outbox. Shared by the single and batch submission routes.
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from . import metrics, outbox, sequencer
+from .fiscal_core import calculate_hash, get_signing_key, public_key_pem, sign_receipt, sign_receipts
+from .fiscal_day import FiscalDayError, record_receipts
+from .idempotency import IdempotencyConflict, fingerprint, get_cache
+from .models import db, DeviceKey, Receipt, ReceiptLine, ReceiptSubmission
+from .timing import stage
+
+# How often a sale is retried when another process took its global number
+SEQUENCE_RETRIES = 3
+
+# (device_id, fingerprint) of keys already stored as DeviceKey rows, so a sale
+# doesn't look its key up again
+_recorded_keys = set()
+
+
+def issue_receipts(config, sales):
+    """Issues one receipt per sale in a single transaction.
+
+    Each sale is {"currency", "bill"}, where the bill comes from
+    tax.calculate_receipt(), plus an optional idempotency "key". A sale whose
+    key was already issued gets the original response back instead of a new
+    receipt; IdempotencyConflict is raised if that key was issued for a
+    different sale.
+
+    Returns the till response for each receipt, in order.
+    """
+    sales = [{**sale, "fingerprint": fingerprint(sale['currency'], sale['bill']) if sale.get('key') else None}
+             for sale in sales]
+    results = _cached_responses(config.device_id, sales)
+    if all(results):
+        metrics.RECEIPTS_REPLAYED.inc(amount=len(results))
+        return results
+
+    day_rechecked = False
+    for attempt in range(SEQUENCE_RETRIES):
+        try:
+            # Only sales on this device wait for each other here
+            with sequencer.reserve(config) as chain:
+                # Checked again under the lock: the original may have just committed
+                results = _replayed_responses(config.device_id, sales)
+                pending = [i for i, result in enumerate(results) if result is None]
+                if not pending:
+                    metrics.RECEIPTS_REPLAYED.inc(amount=len(results))
+                    return results
+                if not chain.is_day_open:
+                    raise FiscalDayError("Fiscal Day is NOT Open")
+                drafts = [_prepare_receipt(config, chain, sales[i]['bill'], sales[i]['currency'],
+                                           sales[i]['key'], sales[i]['fingerprint'])
+                          for i in pending]
+
+                # Hashes are chained in order; signatures are independent of each other
+                signing_key, key_fingerprint = get_signing_key(config.device_id)
+                with stage('sign'):
+                    if len(drafts) == 1:
+                        signatures = [sign_receipt(config.device_id, drafts[0]['hash'], signing_key)]
+                    else:
+                        signatures = sign_receipts(config.device_id, [d['hash'] for d in drafts], signing_key)
+
+                for i, draft, signature in zip(pending, drafts, signatures):
+                    results[i] = _stage_receipt(draft, signature, key_fingerprint)
+                _record_signing_key(config.device_id, signing_key, key_fingerprint)
+                record_receipts(config.device_id, chain.fiscal_day_no, drafts)
+                config.last_global_no = chain.global_no
+                config.last_receipt_hash = chain.last_hash
+                with stage('db_commit'):
+                    db.session.commit()
+            _recorded_keys.add((config.device_id, key_fingerprint))
+            metrics.RECEIPTS_ISSUED.inc(amount=len(drafts))
+            metrics.RECEIPTS_REPLAYED.inc(amount=len(results) - len(drafts))
+            # Only remembered once committed, so a failed sale can be retried as new
+            cache = get_cache()
+            for i, draft in zip(pending, drafts):
+                if draft['key']:
+                    cache.put(config.device_id, draft['key'], (draft['fingerprint'], results[i]))
+            return results
+        except FiscalDayError:
+            # Drop the receipts already flushed for the stale day; raising re-seeds the
+            # device, so a day opened by another worker shows on the retry
+            db.session.rollback()
+            if day_rechecked or attempt == SEQUENCE_RETRIES - 1:
+                raise
+            day_rechecked = True
+        except IntegrityError:
+            # Another process issued this number (or this key) first: re-seed and try again
+            db.session.rollback()
+            metrics.SEQUENCE_CONFLICTS.inc()
+            if attempt == SEQUENCE_RETRIES - 1:
+                raise
+
+
+def _record_signing_key(device_id, private_key, key_fingerprint):
+    """Stores the public half of a key the first time it signs (caller commits)"""
+    if (device_id, key_fingerprint) in _recorded_keys:
+        return
+    if not DeviceKey.query.filter_by(device_id=device_id, fingerprint=key_fingerprint).first():
+        db.session.add(DeviceKey(device_id=device_id, fingerprint=key_fingerprint,
+                                 public_key=public_key_pem(private_key.public_key()).decode('utf-8')))
+
+
+def _cached_responses(device_id, sales):
+    cache = get_cache()
+    results = []
+    for sale in sales:
+        entry = cache.get(device_id, sale['key']) if sale.get('key') else None
+        if entry is not None:
+            _check_fingerprint(sale, entry[0])
+        results.append(entry[1] if entry is not None else None)
+    return _with_current_status(device_id, results)
+
+
+def _check_fingerprint(sale, stored):
+    # Receipts issued before fingerprints were kept have none to compare
+    if stored and stored != sale['fingerprint']:
+        raise IdempotencyConflict(sale['key'])
+
+
+def _with_current_status(device_id, results):
+    """Copies of remembered responses carrying the outbox's current delivery state"""
+    global_nos = [result['globalNo'] for result in results if result is not None]
+    if not global_nos:
+        return results
+    statuses = dict(db.session.query(ReceiptSubmission.global_no, ReceiptSubmission.status)
+                    .filter(ReceiptSubmission.device_id == device_id, ReceiptSubmission.global_no.in_(global_nos)))
+    # Submissions of archived days are gone: those keep the state they were remembered with
+    return [{**result, "verification": {**result['verification'],
+                                        "server_status": statuses.get(result['globalNo'],
+                                                                      result['verification']['server_status'])}}
+            if result is not None else None for result in results]
+
+
+def _replayed_responses(device_id, sales):
+    """Original responses for sales whose key was already issued (None for new sales)"""
+    results = _cached_responses(device_id, sales)
+    missing = [sale['key'] for sale, result in zip(sales, results) if sale.get('key') and result is None]
+    if not missing:
+        return results
+
+    cache = get_cache()
+    issued = {receipt.idempotency_key: receipt for receipt in
+              Receipt.query.filter(Receipt.device_id == device_id, Receipt.idempotency_key.in_(missing))}
+    for i, sale in enumerate(sales):
+        receipt = issued.get(sale.get('key'))
+        if results[i] is None and receipt is not None:
+            _check_fingerprint(sale, receipt.idempotency_fingerprint)
+            server_status = receipt.submission.status if receipt.submission else "Queued"
+            results[i] = receipt_response(receipt, server_status)
+            cache.put(device_id, sale['key'], (receipt.idempotency_fingerprint, results[i]))
+    return results
+
+
+def _prepare_receipt(config, chain, bill, currency, key=None, fingerprint=None):
+    """Takes the next number from the device's chain and hashes the receipt"""
+    amount = bill['total_cents'] / 100
+    # 2. Take the next Counters (Global No, etc.) from the device's chain
+    device_id = config.device_id
+    new_global = chain.next_global_no()
+    prev_hash = chain.last_hash
+    now = datetime.now()
+    date_str = now.strftime("%Y%m%d%H%M%S") # Format: YYYYMMDDHHMMSS
+
+    # 3. Local Security (Calculate Hash)
+    # We hash: DeviceID + FiscalDay + GlobalNo + Amount + PrevHash + Date
+    with stage('hash'):
+        current_hash = calculate_hash(device_id, chain.fiscal_day_no, new_global, bill['total_cents'],
+                                      prev_hash, date_str)
+    chain.append(current_hash)
+
+    # Day totals per tax category
+    taxes = {}
+    for group in bill['taxes']:
+        sales_cents, tax_cents = taxes.get(group['tax_category'], (0, 0))
+        taxes[group['tax_category']] = (sales_cents + group['sales_cents'], tax_cents + group['tax_cents'])
+
+    return {
+        "device_id": device_id,
+        "fiscal_day": chain.fiscal_day_no,
+        "global_no": new_global,
+        "invoice_no": f"INV-{new_global:06d}",
+        "amount": amount,
+        "currency": currency,
+        "bill": bill,
+        "taxes": taxes,
+        "prev_hash": prev_hash,
+        "hash": current_hash,
+        "now": now,
+        "date_str": date_str,
+        "key": key,
+        "fingerprint": fingerprint
+    }
+
+
+def _stage_receipt(draft, signature, key_fingerprint=None):
+    """Adds the signed receipt and its outbox entry to the session (caller commits)"""
+    device_id = draft['device_id']
+    new_global = draft['global_no']
+    invoice_no = draft['invoice_no']
+    amount = draft['amount']
+    bill = draft['bill']
+    current_hash = draft['hash']
+
+    # 4. Prepare ZIMRA Payload (Matches Mock Server 'SubmitReceiptRequest')
+    # This is the complex JSON structure ZIMRA expects
+    zimra_payload = {
+        "receiptType": "FiscalInvoice",
+        "receiptCurrency": draft['currency'],
+        "receiptCounter": new_global, # Simplified for demo
+        "receiptGlobalNo": new_global,
+        "invoiceNo": invoice_no,
+        "receiptDate": draft['now'].isoformat(),
+        "receiptLinesTaxInclusive": True,
+        "receiptLines": [
+            {
+                "receiptLineType": "Sale",
+                "receiptLineNo": line['line_no'],
+                "receiptLineName": line['name'],
+                "receiptLineQuantity": line['quantity'],
+                "receiptLinePrice": line['unit_price_cents'] / 100,
+                "receiptLineTotal": line['total_cents'] / 100,
+                "taxPercent": line['tax_percent'],
+                "taxID": line['tax_id']
+            } for line in bill['lines']
+        ],
+        "receiptTaxes": [
+            {
+                "taxID": group['tax_id'],
+                "taxPercent": group['tax_percent'],
+                "taxAmount": group['tax_cents'] / 100,
+                "salesAmountWithTax": group['sales_cents'] / 100
+            } for group in bill['taxes']
+        ],
+        "receiptPayments": [
+            {
+                "moneyTypeCode": "Cash",
+                "paymentAmount": amount
+            }
+        ],
+        "receiptTotal": amount,
+        "receiptDeviceSignature": {
+            "hash": current_hash,
+            "signature": signature
+        }
+    }
+
+    # 5. Save to Local DB together with its Outbox entry
+    # The cashier never waits on ZIMRA: the outbox worker reports it in the background
+    new_receipt = Receipt(
+        device_id=device_id,
+        fiscal_day_no=draft['fiscal_day'],
+        global_no=new_global,
+        invoice_no=invoice_no,
+        currency=draft['currency'],
+        total_amount=amount,
+        tax_amount=bill['tax_cents'] / 100,
+        previous_hash=draft['prev_hash'],
+        receipt_hash=current_hash,
+        signature=signature,
+        date_created=draft['now'],
+        idempotency_key=draft['key'],
+        idempotency_fingerprint=draft['fingerprint'],
+        key_fingerprint=key_fingerprint
+    )
+    new_receipt.lines = [ReceiptLine(
+        line_no=line['line_no'],
+        name=line['name'],
+        quantity=line['quantity'],
+        unit_price_cents=line['unit_price_cents'],
+        total_cents=line['total_cents'],
+        tax_cents=line['tax_cents'],
+        tax_category=line['tax_category'],
+        tax_percent=line['tax_percent']
+    ) for line in bill['lines']]
+    db.session.add(new_receipt)
+    outbox.enqueue(new_receipt, device_id, zimra_payload)
+    return receipt_response(new_receipt, "Queued")
+
+
+def receipt_response(receipt, server_status):
+    """The till's response for an issued receipt (also used to answer replays)"""
+    date_str = receipt.date_created.strftime("%Y%m%d%H%M%S")
+
+    # 6. Data returned to the till for the QR Code
+    # QR Format: DeviceID + Date + GlobalNo + InternalHash + ServerSig(Optional)
+    qr_raw_data = f"{receipt.device_id}{date_str}{receipt.global_no}{receipt.receipt_hash}"
+
+    return {
+        "status": "success",
+        "invoiceNo": receipt.invoice_no,
+        "globalNo": receipt.global_no,
+        "amount": receipt.total_amount,
+        "taxAmount": receipt.tax_amount,
+        "date": date_str,
+        "verification": {
+            "device_hash": receipt.receipt_hash,
+            "server_status": server_status,
+            "signature": receipt.signature
+        },
+        "qr_data": qr_raw_data
+    }
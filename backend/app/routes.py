@@ -1,9 +1,15 @@
-# --- ADD 'requests' TO IMPORTS ---
-import requests 
-from flask import Blueprint, request, jsonify
-from datetime import datetime
-from .models import db, DeviceConfig, Receipt
-from .fiscal_core import calculate_hash, sign_receipt, generate_device_keys, generate_csr
+import json
+import os
+import tempfile
+import time
+
+import requests
+from flask import Blueprint, Response, request, jsonify, current_app, send_file, stream_with_context
+from . import archive, audit, export, fiscal_day, idempotency, metrics, outbox, provisioning, sequencer, status, tax, timing
+from .gateway import get_gateway, store_certificate
+from .models import db, DayArchive, DeviceConfig, ReceiptSubmission
+from .fiscal_core import generate_device_keys, generate_csr
+from .receipts import issue_receipts
 
 api_bp = Blueprint('api', __name__)
 
@@ -16,11 +22,8 @@ def fetch_zimra_id():
     try:
         # 1. Ask Mock Server for an ID
         # Note: We use the Public/v1 route we just created
-        zimra_url = "http://localhost:4000/Public/v1/LookupDeviceID"
-        payload = {"serialNumber": serial_no}
-        
         print(f"Requesting ID from ZIMRA for: {serial_no}")
-        response = requests.post(zimra_url, json=payload)
+        response = get_gateway().lookup_device_id(serial_no)
         
         if response.status_code != 200:
             return jsonify({"status": "error", "message": "ZIMRA Rejected Serial", "details": response.text}), 400
@@ -41,21 +44,44 @@ def fetch_zimra_id():
 @api_bp.route('/device/status', methods=['GET'])
 def device_status():
     try:
-        config = DeviceConfig.query.first()
-        # Only return 'configured' if we actually have the Certificate
-        if config and config.is_registered: 
-            return jsonify({
-                "status": "configured",
-                "deviceID": config.device_id,
-                "serialNumber": config.serial_number,
-                "is_day_open": config.is_day_open,
-                "fiscal_day": config.current_fiscal_day
-            })
-        else:
-            return jsonify({"status": "not_configured"})
+        # Cached until registration or a day change, and 304 when the till already has it
+        etag, body = status.get_broadcaster().snapshot(request.args.get('deviceID'))
+        response = jsonify(body)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# --- 1b. STATUS STREAM (Server-Sent Events, pushed on every change) ---
+@api_bp.route('/device/status/stream', methods=['GET'])
+def device_status_stream():
+    device_id = request.args.get('deviceID')
+    broadcaster = status.get_broadcaster()
+    keepalive = current_app.config['STATUS_STREAM_KEEPALIVE']
+    
+    def events():
+        version = broadcaster.version
+        sent = None
+        yield "retry: 3000\n\n"
+        written_at = time.monotonic()
+        while True:
+            etag, body = broadcaster.snapshot(device_id)
+            # Don't hold a pooled connection while the till is idle
+            db.session.close()
+            if etag != sent:
+                sent = etag
+                written_at = time.monotonic()
+                yield f"id: {etag}\nevent: status\ndata: {json.dumps(body)}\n\n"
+            elif time.monotonic() - written_at >= keepalive:
+                written_at = time.monotonic()
+                yield ": keepalive\n\n"
+            # Woken by local changes; the timeout re-checks for other workers' changes
+            version = broadcaster.wait(version, broadcaster.ttl)
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # --- 2. GENERATE KEYS (Step 1) ---
 @api_bp.route('/setup/generate-keys', methods=['POST'])
 def generate_keys_route():
@@ -66,12 +92,14 @@ def generate_keys_route():
     try:
         key_path, private_key = generate_device_keys(device_id)
         csr_pem = generate_csr(device_id, serial_no, private_key)
+        get_gateway().reset_device(device_id)
         
         # Save temp config
         if not DeviceConfig.query.filter_by(device_id=str(device_id)).first():
             new_config = DeviceConfig(device_id=str(device_id), serial_number=serial_no)
             db.session.add(new_config)
             db.session.commit()
+            status.invalidate()
             
         return jsonify({"status": "success", "csr": csr_pem})
     except Exception as e:
@@ -85,19 +113,12 @@ def register_with_zimra():
     csr_pem = data.get('csr') # Frontend sends us the CSR back to confirm
     
     try:
-        # A. Prepare the Payload for the Mock Server
-        # This matches what your Mock Server expects
-        payload = {
-            "deviceid": int(device_id),
-            "csr": csr_pem
-        }
-        
-        # B. Send to Mock Server (ZIMRA)
+        # A/B. Send the CSR to Mock Server (ZIMRA)
         # Note: We use the URL from your config (http://localhost:4000/Device/v1)
-        zimra_url = "http://localhost:4000/Device/v1/IssueCertificate"
-        print(f"Connecting to ZIMRA: {zimra_url}")
+        gateway = get_gateway()
+        print(f"Connecting to ZIMRA: {gateway.device_url}/IssueCertificate")
         
-        response = requests.post(zimra_url, json=payload)
+        response = gateway.issue_certificate(device_id, csr_pem)
         
         if response.status_code != 200:
             return jsonify({"status": "error", "message": "ZIMRA Rejected Request", "details": response.text}), 400
@@ -112,6 +133,11 @@ def register_with_zimra():
             config.certificate = certificate
             config.is_registered = True
             db.session.commit()
+            # Every process's next session for this device picks up the new client certificate
+            if certificate:
+                store_certificate(device_id, certificate)
+            gateway.reset_device(device_id)
+            status.invalidate()
             
         return jsonify({"status": "success", "certificate": certificate})
         
@@ -120,147 +146,313 @@ def register_with_zimra():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# --- 4. FLEET PROVISIONING (steps 0-3 for many devices at once) ---
+@api_bp.route('/setup/provision', methods=['POST'])
+def provision_fleet():
+    data = request.json or {}
+    devices = data.get('devices') or []
+    if len(devices) > current_app.config['PROVISION_BATCH_LIMIT']:
+        return jsonify({"status": "error", "message": f"At most {current_app.config['PROVISION_BATCH_LIMIT']} devices per request"}), 413
+    try:
+        results = provisioning.provision_devices(devices, force=bool(data.get('force')))
+    except provisioning.ProvisioningError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+    
+    counts = provisioning.summarize(results)
+    # Re-post the same list to retry the failures; registered devices are skipped
+    return jsonify({"status": "success" if not counts['failed'] else "partial", **counts, "devices": results})
+
 # --- (Keep your existing Open Day, Close Day, Submit Receipt routes below) ---
 @api_bp.route('/day/open', methods=['POST'])
 def open_day():
-    # ... (Keep existing code) ...
     data = request.json
     device_id = str(data.get('deviceID'))
     config = DeviceConfig.query.filter_by(device_id=device_id).first()
     if not config:
         return jsonify({"status": "error", "message": "Device not found"}), 404
-    if config.is_day_open:
-        return jsonify({"status": "error", "message": "Day already open"}), 400
-    config.is_day_open = True
-    config.current_fiscal_day += 1
-    db.session.commit()
+    try:
+        # Day changes are rare: start from the database in case another worker made one
+        sequencer.reset(config.device_id)
+        with sequencer.reserve(config) as chain:
+            fiscal_day.open_day(config, chain)
+            db.session.commit()
+    except fiscal_day.FiscalDayError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    status.invalidate()
     return jsonify({"status": "success", "fiscalDayNo": config.current_fiscal_day})
 
 @api_bp.route('/day/close', methods=['POST'])
 def close_day():
-    # ... (Keep existing code) ...
     data = request.json
     device_id = str(data.get('deviceID'))
     config = DeviceConfig.query.filter_by(device_id=device_id).first()
-    if config:
-        config.is_day_open = False
-        db.session.commit()
-        return jsonify({"status": "success", "message": "Day Closed"})
-    return jsonify({"status": "error"}), 400
+    if not config:
+        return jsonify({"status": "error", "message": "Device not found"}), 404
+    try:
+        # Taking the device lock means no sale can land in the day after its report
+        sequencer.reset(config.device_id)
+        with sequencer.reserve(config) as chain:
+            day = fiscal_day.close_day(config, chain)
+            db.session.commit()
+    except fiscal_day.FiscalDayError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    status.invalidate()
+    return jsonify({"status": "success", "message": "Day Closed", "report": fiscal_day.build_report(day)})
+
+# --- FISCAL DAY REPORT (X-Report while open, signed Z-Report once closed) ---
+@api_bp.route('/day/report', methods=['GET'])
+def day_report():
+    device_id = request.args.get('deviceID')
+    config = DeviceConfig.query.filter_by(device_id=str(device_id)).first()
+    if not config:
+        return jsonify({"status": "error", "message": "Device not found"}), 404
+    fiscal_day_no = request.args.get('fiscalDayNo', type=int) or config.current_fiscal_day
+    day = fiscal_day.get_fiscal_day(config.device_id, fiscal_day_no)
+    if not day:
+        return jsonify({"status": "error", "message": "Fiscal day not found"}), 404
+    return jsonify({"status": "success", "report": fiscal_day.build_report(day)})
 
 @api_bp.route('/submit-receipt', methods=['POST'])
 def submit_receipt():
     data = request.json
     device_id = str(data.get('deviceID'))
-    amount = float(data.get('totalAmount'))
     # Default to "Cash" for this demo
     currency = data.get('currency', 'ZWG') 
     
-    # 1. Validation
+    # A retried sale carries the same key and gets its original receipt back
+    key = request.headers.get('Idempotency-Key') or data.get('clientReceiptId')
+    if key and len(str(key)) > idempotency.MAX_KEY_LENGTH:
+        return jsonify({"status": "error", "message": f"Idempotency key longer than {idempotency.MAX_KEY_LENGTH} characters"}), 400
+    
+    # 1. Validation (and pricing the cart in cents); the open day is checked when issuing
     config = DeviceConfig.query.filter_by(device_id=device_id).first()
-    if not config or not config.is_day_open:
+    if not config:
         return jsonify({"status": "error", "message": "Fiscal Day is NOT Open"}), 400
-        
     try:
-        # 2. Calculate Counters (Global No, etc.)
-        last_receipt = Receipt.query.order_by(Receipt.global_no.desc()).first()
-        new_global = (last_receipt.global_no + 1) if last_receipt else 1
-        invoice_no = f"INV-{new_global:06d}"
-        prev_hash = config.last_receipt_hash
-        date_str = datetime.now().strftime("%Y%m%d%H%M%S") # Format: YYYYMMDDHHMMSS
-        
-        # 3. Local Security (Calculate Hash & Sign)
-        # We sign: DeviceID + FiscalDay + GlobalNo + Amount + PrevHash + Date
-        current_hash = calculate_hash(device_id, config.current_fiscal_day, new_global, amount, prev_hash, date_str)
-        signature = sign_receipt(device_id, current_hash)
-        
-        # 4. Prepare ZIMRA Payload (Matches Mock Server 'SubmitReceiptRequest')
-        # This is the complex JSON structure ZIMRA expects
-        zimra_payload = {
-            "receiptType": "FiscalInvoice",
-            "receiptCurrency": currency,
-            "receiptCounter": new_global, # Simplified for demo
-            "receiptGlobalNo": new_global,
-            "invoiceNo": invoice_no,
-            "receiptDate": datetime.now().isoformat(),
-            "receiptLinesTaxInclusive": True,
-            "receiptLines": [
-                {
-                    "receiptLineType": "Sale",
-                    "receiptLineNo": 1,
-                    "receiptLineName": "General Goods",
-                    "receiptLineQuantity": 1,
-                    "receiptLineTotal": amount,
-                    "taxPercent": 15,
-                    "taxID": 1
-                }
-            ],
-            "receiptTaxes": [],
-            "receiptPayments": [
-                {
-                    "moneyTypeCode": "Cash",
-                    "paymentAmount": amount
-                }
-            ],
-            "receiptTotal": amount,
-            "receiptDeviceSignature": {
-                "hash": current_hash,
-                "signature": signature
-            }
-        }
-        
-        # 5. Send to Mock Server
-        zimra_url = f"http://localhost:4000/Device/v1/{device_id}/SubmitReciept"
-        headers = {
-            "DeviceModelName": "LithiPos",
-            "DeviceModelVersion": "1.0"
-        }
+        bill = _bill_for(data)
+    except tax.TaxError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
         
-        print(f"Reporting Receipt to ZIMRA: {zimra_url}")
-        # Note: 'SubmitReciept' is the spelling in the Mock Server file provided
-        zimra_response = requests.post(zimra_url, json=zimra_payload, headers=headers)
+    try:
+        sale = {"bill": bill, "currency": currency, "key": str(key) if key else None}
+        result = issue_receipts(config, [sale])[0]
+        outbox.notify(current_app)
+        return jsonify(result)
         
-        server_signature = "OFFLINE"
-        if zimra_response.status_code == 200:
-            res_json = zimra_response.json()
-            server_signature = res_json.get('receiptServerSignature', {}).get('signature', 'VERIFIED')
-        else:
-            print(f"ZIMRA Warning: Receipt stored locally but reporting failed: {zimra_response.text}")
+    except fiscal_day.FiscalDayError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except idempotency.IdempotencyConflict as e:
+        return jsonify({"status": "error", "message": str(e)}), 422
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-        # 6. Save to Local DB
-        new_receipt = Receipt(
-            fiscal_day_no=config.current_fiscal_day,
-            global_no=new_global,
-            invoice_no=invoice_no,
-            total_amount=amount,
-            tax_amount=amount * 0.15,
-            previous_hash=prev_hash,
-            receipt_hash=current_hash,
-            signature=signature
-        )
-        
-        config.last_receipt_hash = current_hash
-        db.session.add(new_receipt)
-        db.session.commit()
-        
-        # 7. Return Data for QR Code
-        # QR Format: DeviceID + Date + GlobalNo + InternalHash + ServerSig(Optional)
-        qr_raw_data = f"{device_id}{date_str}{new_global}{current_hash}"
+def _bill_for(data):
+    """Taxes the posted cart, or the legacy single total when no items are sent"""
+    if data.get('items'):
+        return tax.calculate_receipt(data['items'])
+    if data.get('totalAmount') is None:
+        raise tax.TaxError("Send either items or totalAmount")
+    return tax.single_line_receipt(data.get('totalAmount'))
+
+# --- BATCH SUBMISSION (e.g. replaying a till that was offline) ---
+@api_bp.route('/submit-receipts', methods=['POST'])
+def submit_receipts():
+    data = request.json
+    device_id = str(data.get('deviceID'))
+    receipts = data.get('receipts') or []
+    
+    if not receipts:
+        return jsonify({"status": "error", "message": "No receipts supplied"}), 400
+    if len(receipts) > current_app.config['BATCH_RECEIPT_LIMIT']:
+        return jsonify({"status": "error", "message": f"At most {current_app.config['BATCH_RECEIPT_LIMIT']} receipts per batch"}), 413
+    keys = [str(r['clientReceiptId']) if r.get('clientReceiptId') else None for r in receipts]
+    if any(k and len(k) > idempotency.MAX_KEY_LENGTH for k in keys):
+        return jsonify({"status": "error", "message": f"clientReceiptId longer than {idempotency.MAX_KEY_LENGTH} characters"}), 400
+    if len(set(filter(None, keys))) != len(list(filter(None, keys))):
+        return jsonify({"status": "error", "message": "Duplicate clientReceiptId in batch"}), 400
+    try:
+        sales = [{"bill": _bill_for(r), "currency": r.get('currency', 'ZWG'), "key": k}
+                 for r, k in zip(receipts, keys)]
+    except tax.TaxError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    config = DeviceConfig.query.filter_by(device_id=device_id).first()
+    if not config:
+        return jsonify({"status": "error", "message": "Fiscal Day is NOT Open"}), 400
         
-        return jsonify({
-            "status": "success",
-            "invoiceNo": invoice_no,
-            "globalNo": new_global,
-            "amount": amount,
-            "date": date_str,
-            "verification": {
-                "device_hash": current_hash,
-                "server_status": "Reported" if zimra_response.status_code == 200 else "Queued",
-                "signature": signature
-            },
-            "qr_data": qr_raw_data
-        })
+    try:
+        # All receipts are chained, signed and committed as one transaction
+        results = issue_receipts(config, sales)
+        outbox.notify(current_app)
+        return jsonify({"status": "success", "count": len(results), "receipts": results})
         
+    except fiscal_day.FiscalDayError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except idempotency.IdempotencyConflict as e:
+        return jsonify({"status": "error", "message": str(e)}), 422
     except Exception as e:
         print(e)
-        return jsonify({"status": "error", "message": str(e)}), 500
\ No newline at end of file
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# --- RECEIPT DELIVERY STATE (Outbox) ---
+@api_bp.route('/receipt/<int:global_no>/status', methods=['GET'])
+def receipt_status(global_no):
+    # Global numbers are issued per device, so the number alone is ambiguous
+    device_id = request.args.get('deviceID')
+    if not device_id:
+        return jsonify({"status": "error", "message": "deviceID is required"}), 400
+    submission = ReceiptSubmission.query.filter_by(device_id=str(device_id), global_no=global_no).first()
+    if not submission:
+        return _archived_receipt_status(device_id, global_no)
+    return jsonify({
+        "status": "success",
+        "deviceID": submission.device_id,
+        "globalNo": submission.global_no,
+        "server_status": submission.status,
+        "attempts": submission.attempts,
+        "next_attempt_at": submission.next_attempt_at.isoformat() if submission.next_attempt_at else None,
+        "reported_at": submission.reported_at.isoformat() if submission.reported_at else None,
+        "server_signature": submission.server_signature,
+        "last_error": submission.last_error
+    })
+
+def _archived_receipt_status(device_id, global_no):
+    # Receipts of archived fiscal days are looked up in their day file
+    try:
+        record = archive.find_receipt(device_id, global_no)
+    except archive.ArchiveError as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    if not record or not record['submission']:
+        return jsonify({"status": "error", "message": "Receipt not found"}), 404
+    submission = record['submission']
+    return jsonify({
+        "status": "success",
+        "deviceID": record['device_id'],
+        "globalNo": record['global_no'],
+        "server_status": submission['status'],
+        "attempts": submission['attempts'],
+        "next_attempt_at": None,
+        "reported_at": submission['reported_at'],
+        "server_signature": submission['server_signature'],
+        "last_error": submission['last_error'],
+        "archived": True
+    })
+
+@api_bp.route('/outbox/status', methods=['GET'])
+def outbox_status():
+    counts = dict(db.session.query(ReceiptSubmission.status, db.func.count(ReceiptSubmission.id))
+                  .group_by(ReceiptSubmission.status).all())
+    return jsonify({
+        "status": "success",
+        "queued": counts.get("Queued", 0),
+        "reported": counts.get("Reported", 0),
+        "rejected": counts.get("Rejected", 0)
+    })
+
+# --- HASH-CHAIN AUDIT ---
+@api_bp.route('/audit/verify', methods=['GET'])
+def audit_verify():
+    device_id = request.args.get('deviceID')
+    if not device_id:
+        return jsonify({"status": "error", "message": "deviceID is required"}), 400
+    
+    # Resume from the checkpoint returned by a previous call
+    checkpoint = None
+    if request.args.get('afterGlobalNo') is not None:
+        checkpoint = {
+            "globalNo": request.args.get('afterGlobalNo', type=int),
+            "receiptHash": request.args.get('prevHash')
+        }
+    limit = min(request.args.get('limit', current_app.config['AUDIT_REQUEST_LIMIT'], type=int),
+                current_app.config['AUDIT_REQUEST_LIMIT'])
+    
+    try:
+        result = audit.verify_chain(device_id, fiscal_day_no=request.args.get('fiscalDayNo', type=int),
+                                    checkpoint=checkpoint, limit=limit)
+        return jsonify({"status": "success", "audit": result.to_dict()})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# --- FISCAL DAY ARCHIVE (closed days moved out of the live tables) ---
+@api_bp.route('/archive/run', methods=['POST'])
+def archive_days():
+    data = request.json or {}
+    try:
+        results = archive.archive_closed_days(device_id=data.get('deviceID'), keep=data.get('keep'))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+    failed = any(r['status'] == 'failed' for r in results)
+    return jsonify({"status": "partial" if failed else "success", "days": results})
+
+@api_bp.route('/archive', methods=['GET'])
+def archived_days():
+    query = DayArchive.query
+    if request.args.get('deviceID'):
+        query = query.filter_by(device_id=str(request.args.get('deviceID')))
+    return jsonify({"status": "success", "days": [{
+        "deviceID": seal.device_id,
+        "fiscalDayNo": seal.fiscal_day_no,
+        "receiptCount": seal.receipt_count,
+        "firstGlobalNo": seal.first_global_no,
+        "lastGlobalNo": seal.last_global_no,
+        "lastReceiptHash": seal.last_receipt_hash,
+        "contentSha256": seal.content_sha256,
+        "archivedAt": seal.archived_at.isoformat() if seal.archived_at else None
+    } for seal in query.order_by(DayArchive.device_id, DayArchive.fiscal_day_no)]})
+
+# --- RECEIPT EXPORT (streamed JSONL/CSV, or a Parquet archive) ---
+@api_bp.route('/receipts/export', methods=['GET'])
+def export_receipts():
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in export.FORMATS:
+        return jsonify({"status": "error", "message": f"format must be one of {', '.join(export.FORMATS)}"}), 400
+    try:
+        start, end = export.parse_range(request.args.get('from'), request.args.get('to'))
+    except export.ExportError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    try:
+        rows = export.receipt_rows(device_id=request.args.get('deviceID'), start=start, end=end,
+                                   fiscal_day_no=request.args.get('fiscalDayNo', type=int))
+    except archive.ArchiveError as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    filename = f"receipts.{fmt}"
+    
+    if fmt == 'parquet':
+        # Columnar files can't be streamed as they're written, so spool to disk
+        fd, path = tempfile.mkstemp(suffix='.parquet')
+        os.close(fd)
+        try:
+            export.write_parquet(rows, path)
+        except export.ExportError as e:
+            os.remove(path)
+            return jsonify({"status": "error", "message": str(e)}), 400
+        response = send_file(path, mimetype=export.FORMATS[fmt], as_attachment=True, download_name=filename)
+        response.call_on_close(lambda: os.remove(path))
+        return response
+    
+    chunks = export.iter_jsonl(rows) if fmt == 'jsonl' else export.iter_csv(rows)
+    return Response(stream_with_context(chunks), mimetype=export.FORMATS[fmt],
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+# --- STAGE TIMINGS (enabled with STAGE_TIMINGS=1, used by benchmark.py) ---
+@api_bp.route('/debug/timings', methods=['GET', 'DELETE'])
+def debug_timings():
+    if not current_app.config['STAGE_TIMINGS_ENDPOINT']:
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    if request.method == 'DELETE':
+        timing.timer.reset()
+        return jsonify({"status": "success"})
+    return jsonify({"status": "success", "stages": timing.timer.snapshot()})
+
+# --- METRICS (Prometheus text format) ---
+@api_bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,152 @@
+# Schema upgrades for databases created by earlier versions of the backend.
+# db.create_all() only creates missing tables, so columns, constraints and
+# indexes added to existing tables are applied here, and the counters the
+# sequencer seeds from are backfilled from the receipts already issued.
+# A database that can't be brought up to date stops startup with a
+# SchemaError instead of failing on the first sale.
+from sqlalchemy import MetaData, UniqueConstraint, inspect, literal, text
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+
+
+class SchemaError(RuntimeError):
+    """Raised when an existing database can't be upgraded to the current models"""
+
+
+def upgrade(app):
+    """Creates missing tables and upgrades existing ones. Runs inside the app context."""
+    from .models import DeviceConfig, Receipt
+
+    existing = set(inspect(db.engine).get_table_names())
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in db.metadata.sorted_tables:
+            if table.name in existing and table is not Receipt.__table__:
+                _add_missing_columns(connection, inspector, table)
+        if 'receipt' in existing:
+            if 'device_id' in _column_names(inspector, 'receipt'):
+                _add_missing_columns(connection, inspector, Receipt.__table__)
+            else:
+                # Receipts from before per-device numbering (global_no unique on its own)
+                _rebuild_legacy_receipts(connection, inspector, app.config['LEGACY_RECEIPT_DEVICE_ID'])
+
+    db.create_all()
+
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in db.metadata.sorted_tables:
+            if table.name in existing:
+                _add_missing_indexes(connection, inspector, table)
+        _backfill_global_numbers(connection, DeviceConfig, Receipt)
+
+    _check(inspect(db.engine))
+
+
+def _column_names(inspector, table_name):
+    return {column['name'] for column in inspector.get_columns(table_name)}
+
+
+def _default_sql(column, dialect):
+    default = column.default
+    if default is None or not default.is_scalar:
+        return None
+    return str(literal(default.arg, column.type).compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+
+def _add_missing_columns(connection, inspector, table):
+    dialect = connection.dialect
+    quote = dialect.identifier_preparer.quote
+    present = _column_names(inspector, table.name)
+    for column in table.columns:
+        if column.name in present:
+            continue
+        ddl = f"{quote(column.name)} {column.type.compile(dialect=dialect)}"
+        default = _default_sql(column, dialect)
+        if default is not None:
+            ddl += f" DEFAULT {default}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+        elif not column.nullable:
+            raise SchemaError(f"Can't add required column {table.name}.{column.name} to existing rows")
+        connection.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {ddl}"))
+
+
+def _rebuild_legacy_receipts(connection, inspector, legacy_device_id):
+    """Copies the receipts into a table with the current layout, assigning them their device"""
+    from .models import Receipt
+
+    devices = [row[0] for row in connection.execute(text("SELECT device_id FROM device_config ORDER BY id"))]
+    count = connection.execute(text("SELECT COUNT(*) FROM receipt")).scalar()
+    device_id = legacy_device_id or (devices[0] if len(devices) == 1 else None)
+    if count and device_id is None:
+        raise SchemaError(
+            f"The receipt table predates per-device numbering and {len(devices)} devices are configured; "
+            "set LEGACY_RECEIPT_DEVICE_ID to the device that issued its receipts")
+
+    dialect = connection.dialect
+    quote = dialect.identifier_preparer.quote
+    upgraded = Receipt.__table__.to_metadata(MetaData(), name='receipt_upgrade')
+    upgraded.create(connection)
+
+    present = _column_names(inspector, 'receipt')
+    columns, values = [], []
+    for column in upgraded.columns:
+        if column.name in present:
+            values.append(quote(column.name))
+        elif column.name == 'device_id':
+            values.append(':device_id')
+        elif _default_sql(column, dialect) is not None:
+            values.append(_default_sql(column, dialect))
+        elif column.nullable:
+            values.append('NULL')
+        else:
+            raise SchemaError(f"Can't fill required column receipt.{column.name} for existing receipts")
+        columns.append(quote(column.name))
+    connection.execute(text(f"INSERT INTO receipt_upgrade ({', '.join(columns)}) "
+                            f"SELECT {', '.join(values)} FROM receipt"), {"device_id": device_id})
+    # Other tables refer to "receipt" by name, so the copy takes over the name
+    connection.execute(text("DROP TABLE receipt"))
+    connection.execute(text("ALTER TABLE receipt_upgrade RENAME TO receipt"))
+
+
+def _add_missing_indexes(connection, inspector, table):
+    indexes = inspector.get_indexes(table.name)
+    names = {index['name'] for index in indexes}
+    unique = {tuple(index['column_names']) for index in indexes if index['unique']}
+    unique |= {tuple(constraint['column_names']) for constraint in inspector.get_unique_constraints(table.name)}
+
+    for index in table.indexes:
+        if index.name not in names:
+            index.create(connection)
+    for constraint in table.constraints:
+        columns = tuple(constraint.columns.keys())
+        if not isinstance(constraint, UniqueConstraint) or columns in unique:
+            continue
+        # A unique index enforces the same rule and can be added to any existing table
+        name = constraint.name or f"uq_{table.name}_{'_'.join(columns)}"
+        quote = connection.dialect.identifier_preparer.quote
+        try:
+            connection.execute(text(f"CREATE UNIQUE INDEX {quote(name)} ON {quote(table.name)} "
+                                    f"({', '.join(quote(c) for c in columns)})"))
+        except IntegrityError:
+            raise SchemaError(f"Existing {table.name} rows break the new unique rule on {', '.join(columns)}")
+
+
+def _backfill_global_numbers(connection, DeviceConfig, Receipt):
+    # The sequencer seeds from DeviceConfig.last_global_no, which older versions didn't keep
+    latest = (db.select(db.func.max(Receipt.global_no))
+              .where(Receipt.device_id == DeviceConfig.device_id)
+              .scalar_subquery())
+    connection.execute(db.update(DeviceConfig)
+                       .where(db.func.coalesce(DeviceConfig.last_global_no, 0) < latest)
+                       .values(last_global_no=latest))
+
+
+def _check(inspector):
+    missing = []
+    for table in db.metadata.sorted_tables:
+        present = _column_names(inspector, table.name)
+        missing += [f"{table.name}.{column.name}" for column in table.columns if column.name not in present]
+    if missing:
+        raise SchemaError(f"Database schema is out of date, missing: {', '.join(missing)}")
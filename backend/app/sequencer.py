@@ -0,0 +1,97 @@
+# Per-device receipt numbering and hash-chain head.
+# Each device keeps its next global number, previous hash and open/closed
+# fiscal day in memory, seeded
+# once from DeviceConfig. Sales are serialized per device (not globally), and
+# the in-memory state only moves forward once the receipt transaction commits.
+import threading
+from contextlib import contextmanager
+
+from .models import db
+
+
+class DeviceSequencer:
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.lock = threading.Lock()
+        self.seeded = False
+        self.global_no = 0
+        self.last_hash = "0"
+        self.fiscal_day_no = 0
+        self.is_day_open = False
+
+    def seed(self, config):
+        # Re-read the row: our copy may predate another till's commit
+        db.session.refresh(config)
+        self.global_no = config.last_global_no or 0
+        self.last_hash = config.last_receipt_hash or "0"
+        self.fiscal_day_no = config.current_fiscal_day or 0
+        self.is_day_open = bool(config.is_day_open)
+        self.seeded = True
+
+
+class ChainCursor:
+    """Working copy of a device's counters for the duration of one transaction"""
+
+    def __init__(self, global_no, last_hash, fiscal_day_no, is_day_open):
+        self.global_no = global_no
+        self.last_hash = last_hash
+        self.fiscal_day_no = fiscal_day_no
+        self.is_day_open = is_day_open
+
+    def next_global_no(self):
+        return self.global_no + 1
+
+    def append(self, receipt_hash):
+        """Records that the next receipt was issued with `receipt_hash`"""
+        self.global_no += 1
+        self.last_hash = receipt_hash
+
+
+_sequencers = {}
+_registry_lock = threading.Lock()
+
+
+def get_sequencer(device_id):
+    device_id = str(device_id)
+    sequencer = _sequencers.get(device_id)
+    if sequencer is None:
+        with _registry_lock:
+            sequencer = _sequencers.setdefault(device_id, DeviceSequencer(device_id))
+    return sequencer
+
+
+@contextmanager
+def reserve(config):
+    """Serializes one receipt transaction for a device.
+
+    The caller must add its receipts (or open/close the day), copy the cursor
+    back onto `config` and commit inside the block. If anything raises, the device is re-seeded from
+    the database on its next sale.
+    """
+    sequencer = get_sequencer(config.device_id)
+    with sequencer.lock:
+        if not sequencer.seeded:
+            sequencer.seed(config)
+        cursor = ChainCursor(sequencer.global_no, sequencer.last_hash,
+                             sequencer.fiscal_day_no, sequencer.is_day_open)
+        try:
+            yield cursor
+        except Exception:
+            sequencer.seeded = False
+            raise
+        sequencer.global_no = cursor.global_no
+        sequencer.last_hash = cursor.last_hash
+        sequencer.fiscal_day_no = cursor.fiscal_day_no
+        sequencer.is_day_open = cursor.is_day_open
+
+
+def reset(device_id=None):
+    """Forgets in-memory state so it is re-seeded from the database"""
+    with _registry_lock:
+        if device_id is None:
+            sequencers = list(_sequencers.values())
+        else:
+            sequencers = [s for s in [_sequencers.get(str(device_id))] if s]
+    for sequencer in sequencers:
+        with sequencer.lock:
+            sequencer.seeded = False
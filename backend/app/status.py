@@ -0,0 +1,103 @@
+# Device and fiscal-day status for the tills.
+# The status body is built once and cached (with its ETag) until registration
+# or opening/closing a day changes it, so polling costs no database reads and
+# a repeated GET can be answered with 304. Streams block on a condition
+# variable and push the new snapshot as soon as it is invalidated.
+import hashlib
+import json
+import threading
+import time
+
+from flask import current_app
+
+
+class StatusBroadcaster:
+    def __init__(self, ttl):
+        # The TTL bounds how long a change made by another process goes unseen
+        self.ttl = ttl
+        self._changed = threading.Condition()
+        self._version = 0
+        self._snapshots = {}
+        self._listeners = set()
+
+    @property
+    def version(self):
+        return self._version
+
+    def snapshot(self, device_id=None):
+        """(etag, status dict) for a device, or for the first device when None"""
+        now = time.monotonic()
+        cached = self._snapshots.get(device_id)
+        if cached and cached[0] > now:
+            return cached[1], cached[2]
+
+        version = self._version
+        body = _build_status(device_id)
+        etag = hashlib.sha1(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()
+        with self._changed:
+            if cached and cached[1] != etag:
+                # Changed behind our back (another worker): wake the streams too
+                self._bump()
+            elif version != self._version:
+                # Invalidated while we were reading, so this may already be stale
+                return etag, body
+            self._snapshots[device_id] = (now + self.ttl, etag, body)
+        return etag, body
+
+    def invalidate(self):
+        """Drops every cached snapshot and wakes the streams"""
+        with self._changed:
+            self._bump()
+
+    def subscribe(self, callback):
+        """Calls `callback()` on every change (from the invalidating thread, so keep it quick)"""
+        with self._changed:
+            self._listeners.add(callback)
+
+    def unsubscribe(self, callback):
+        with self._changed:
+            self._listeners.discard(callback)
+
+    def _bump(self):
+        self._snapshots = {}
+        self._version += 1
+        self._changed.notify_all()
+        for callback in self._listeners:
+            callback()
+
+    def wait(self, version, timeout):
+        """Blocks until the status changes after `version`, or `timeout` seconds"""
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+
+def _build_status(device_id):
+    from .models import DeviceConfig
+
+    query = DeviceConfig.query
+    config = query.filter_by(device_id=str(device_id)).first() if device_id else query.first()
+    # Only return 'configured' if we actually have the Certificate
+    if config and config.is_registered:
+        return {
+            "status": "configured",
+            "deviceID": config.device_id,
+            "serialNumber": config.serial_number,
+            "is_day_open": config.is_day_open,
+            "fiscal_day": config.current_fiscal_day
+        }
+    return {"status": "not_configured"}
+
+
+def init_app(app):
+    broadcaster = StatusBroadcaster(app.config['STATUS_CACHE_TTL'])
+    app.extensions['device_status'] = broadcaster
+    return broadcaster
+
+
+def get_broadcaster(app=None):
+    return (app or current_app).extensions['device_status']
+
+
+def invalidate(app=None):
+    get_broadcaster(app).invalidate()
@@ -0,0 +1,45 @@
+# Database engine profile.
+# SQLite gets WAL journaling, relaxed fsync and a busy timeout on every
+# connection; other databases (e.g. PostgreSQL for multi-till sites) get a
+# sized, pre-pinged connection pool.
+from sqlalchemy import event
+
+from . import db
+
+
+def configure(app):
+    """Fills in SQLALCHEMY_ENGINE_OPTIONS for the configured database (before db.init_app)"""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+
+    if uri.startswith('sqlite'):
+        busy_timeout = app.config['SQLITE_PRAGMAS'].get('busy_timeout', 0)
+        connect_args = dict(options.get('connect_args') or {})
+        connect_args.setdefault('timeout', busy_timeout / 1000)
+        # Pooled connections are shared between request threads and the outbox worker
+        connect_args.setdefault('check_same_thread', False)
+        options['connect_args'] = connect_args
+        if uri not in ('sqlite://', 'sqlite:///:memory:'):
+            options.setdefault('pool_size', app.config['DB_POOL_SIZE'])
+            options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+    else:
+        options.setdefault('pool_size', app.config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+        options.setdefault('pool_pre_ping', True)
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def init_app(app):
+    """Applies SQLite PRAGMAs to each new connection (inside the app context, after db.init_app)"""
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = app.config['SQLITE_PRAGMAS']
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
@@ -0,0 +1,142 @@
+# Receipt line and tax calculation in integer cents.
+# Carts are turned into columns (price, quantity, rate...) and each step runs
+# over whole columns at once, so a wholesale basket with hundreds of lines is
+# taxed in a few tight passes with exact integer arithmetic - no float cents.
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from .enums import TaxCategory, TAX_ID, TAX_PERCENT
+
+# Tax rates are handled in basis points: 15% -> 1500
+BASIS_POINTS = 10000
+MAX_RECEIPT_LINES = 1000
+
+
+class TaxError(ValueError):
+    """Raised for cart items that can't be taxed (missing price, bad rate...)"""
+
+
+def _decimal(value, field, line_no):
+    try:
+        number = Decimal(str(value))
+    except (InvalidOperation, TypeError):
+        raise TaxError(f"Line {line_no}: {field} must be a number")
+    if not number.is_finite():
+        raise TaxError(f"Line {line_no}: {field} must be a number")
+    return number
+
+
+def _round_div(numerator, denominator):
+    """Integer division rounded half up (amounts are never negative here)"""
+    return (2 * numerator + denominator) // (2 * denominator)
+
+
+def calculate_receipt(items):
+    """Prices and taxes a cart.
+
+    `items` are frontend CartItems: name, price, quantity, taxRate (0.15 for
+    15%), taxInclusive and optionally taxCategory. Returns the lines (all
+    stated tax-inclusive, as reported to ZIMRA, so a tax-exclusive unit price
+    is restated with its tax), the per-tax-group totals and the receipt
+    total/tax, every amount in cents. The rate must be the one of the line's
+    tax category (15% standard, 0 zero-rated; exempt lines aren't taxed).
+    """
+    if not items:
+        raise TaxError("A receipt needs at least one line")
+    if len(items) > MAX_RECEIPT_LINES:
+        raise TaxError(f"A receipt can have at most {MAX_RECEIPT_LINES} lines")
+
+    # 1. Parse into columns
+    names, quantities, price_cents, rates_bp, inclusive, categories = [], [], [], [], [], []
+    for line_no, item in enumerate(items, start=1):
+        quantity = _decimal(item.get('quantity', 1), 'quantity', line_no)
+        price = _decimal(item.get('price'), 'price', line_no)
+        rate = _decimal(item.get('taxRate', 0), 'taxRate', line_no)
+        if quantity <= 0 or price < 0 or rate < 0:
+            raise TaxError(f"Line {line_no}: quantity must be positive, price and taxRate not negative")
+        if rate > 1:
+            raise TaxError(f"Line {line_no}: taxRate is a fraction (0.15 for 15%), not a percentage")
+
+        category = item.get('taxCategory')
+        if category is None:
+            category = TaxCategory.STANDARD if rate > 0 else TaxCategory.ZERO_RATED
+        else:
+            try:
+                category = TaxCategory(category)
+            except ValueError:
+                raise TaxError(f"Line {line_no}: unknown taxCategory {category}")
+        if TAX_PERCENT[category] is None:
+            rate = Decimal(0)
+        elif rate * 100 != TAX_PERCENT[category]:
+            # The category decides the taxID and percent ZIMRA sees, so the rate must agree
+            raise TaxError(f"Line {line_no}: taxRate {rate} doesn't match {category.value} "
+                           f"({Decimal(TAX_PERCENT[category]) / 100})")
+
+        names.append(str(item.get('name') or f"Item {line_no}")[:100])
+        quantities.append(quantity)
+        price_cents.append(price * 100)
+        rates_bp.append(int((rate * BASIS_POINTS).to_integral_value(ROUND_HALF_UP)))
+        inclusive.append(bool(item.get('taxInclusive', True)))
+        categories.append(category)
+
+    # 2. Line amounts as entered (cents, rounded once per line)
+    entered = [int((p * q).to_integral_value(ROUND_HALF_UP)) for p, q in zip(price_cents, quantities)]
+
+    # 3. Tax per line: inclusive lines carry it inside, exclusive lines add it on top.
+    #    Only informational; the receipt's tax is worked out per tax group below
+    taxes = [
+        _round_div(amount * bp, BASIS_POINTS + bp) if incl else _round_div(amount * bp, BASIS_POINTS)
+        for amount, bp, incl in zip(entered, rates_bp, inclusive)
+    ]
+    totals = [amount if incl else amount + tax for amount, tax, incl in zip(entered, taxes, inclusive)]
+    # Lines are reported tax-inclusive, so exclusive prices are restated with their tax
+    units = [price if incl else Decimal(total) / quantity
+             for price, total, quantity, incl in zip(price_cents, totals, quantities, inclusive)]
+
+    lines = [{
+        "line_no": line_no,
+        "name": name,
+        "quantity": float(quantity),
+        "unit_price_cents": int(unit.to_integral_value(ROUND_HALF_UP)),
+        "total_cents": total,
+        "tax_cents": tax,
+        "tax_category": category.value,
+        "tax_percent": None if TAX_PERCENT[category] is None else bp / 100,
+        "tax_id": TAX_ID[category]
+    } for line_no, (name, quantity, unit, total, tax, category, bp) in enumerate(
+        zip(names, quantities, units, totals, taxes, categories, rates_bp), start=1)]
+
+    # 4. Group into receipt taxes (one per category and rate). Each group's tax is
+    #    rounded once from its tax-inclusive sales, so per-line rounding doesn't add up
+    #    over a long cart (300 lines of 0.10 at 15% carry 391c of tax, not 300c)
+    groups = OrderedDict()
+    for line, bp in zip(lines, rates_bp):
+        key = (line['tax_category'], bp)
+        group = groups.setdefault(key, {
+            "tax_category": line['tax_category'],
+            "tax_id": line['tax_id'],
+            "tax_percent": line['tax_percent'],
+            "sales_cents": 0,
+            "tax_cents": 0
+        })
+        group['sales_cents'] += line['total_cents']
+    for (_, bp), group in groups.items():
+        group['tax_cents'] = _round_div(group['sales_cents'] * bp, BASIS_POINTS + bp)
+
+    return {
+        "lines": lines,
+        "taxes": list(groups.values()),
+        "total_cents": sum(totals),
+        "tax_cents": sum(group['tax_cents'] for group in groups.values())
+    }
+
+
+def single_line_receipt(amount):
+    """The legacy one-line "General Goods" receipt for tills that only send a total"""
+    return calculate_receipt([{
+        "name": "General Goods",
+        "price": amount,
+        "quantity": 1,
+        "taxRate": Decimal(TAX_PERCENT[TaxCategory.STANDARD]) / 100,
+        "taxInclusive": True
+    }])
@@ -0,0 +1,94 @@
+# Stage timings for the receipt hot path.
+# Each named stage (hash, sign, db_commit, upstream) keeps its most recent
+# durations in a bounded ring so percentiles can be read at any time without
+# the memory growing with traffic. Every duration also goes to the
+# /api/metrics histograms and, when tracing, to the current request's trace.
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+from .metrics import STAGE_SECONDS
+
+STAGES = ('hash', 'sign', 'db_commit', 'upstream')
+SAMPLES_PER_STAGE = 50000
+
+
+class StageTimer:
+    def __init__(self, max_samples=SAMPLES_PER_STAGE):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.max_samples)
+            samples.append(seconds)
+        STAGE_SECONDS.observe(seconds, name)
+        if has_request_context() and 'stage_trace' in g:
+            g.stage_trace.append((name, seconds))
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def snapshot(self):
+        """Count, mean and p50/p95/p99 in milliseconds for every stage seen so far"""
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+        return {name: _summary(values) for name, values in samples.items() if values}
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+def start_trace():
+    """Collects the stages run while handling the current request"""
+    g.stage_trace = []
+
+
+def server_timing(response):
+    """Adds the request's stages as a Server-Timing header (durations in ms)"""
+    trace = g.pop('stage_trace', None)
+    if trace:
+        totals = {}
+        for name, seconds in trace:
+            totals[name] = totals.get(name, 0) + seconds
+        response.headers['Server-Timing'] = ", ".join(
+            f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items())
+    return response
+
+
+def init_app(app):
+    # Opt-in, so regular traffic doesn't pay for building the header
+    if app.config['SERVER_TIMING_HEADER']:
+        app.before_request(start_trace)
+        app.after_request(server_timing)
+
+
+def _percentile(ordered, fraction):
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _summary(ordered):
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": _percentile(ordered, 0.50) * 1000,
+        "p95_ms": _percentile(ordered, 0.95) * 1000,
+        "p99_ms": _percentile(ordered, 0.99) * 1000
+    }
+
+
+timer = StageTimer()
+stage = timer.stage
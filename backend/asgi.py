@@ -0,0 +1,4 @@
+from app.asgi import create_asgi_app
+
+# Served by uvicorn, e.g. `uvicorn asgi:app` (or `python serve.py` for several workers)
+app = create_asgi_app()
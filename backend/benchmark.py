@@ -0,0 +1,181 @@
+"""Load test for /api/submit-receipt with many simulated tills.
+
+Start the fiscal server stand-in and the backend (with stage timings on), then
+drive them:
+
+    python mock_zimra.py --latency-ms 80 --jitter-ms 40
+    STAGE_TIMINGS=1 python run.py
+    python benchmark.py --tills 20 --receipts 100 --items 5
+
+Each till is its own registered device with an open fiscal day, posting
+receipts back to back. The report gives throughput, end-to-end latency
+percentiles and the backend's hash / sign / db_commit / upstream stage
+percentiles. With --baseline the run fails (exit 1) when throughput drops or
+p95 latency rises by more than --tolerance, which is what CI uses.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+import requests
+
+BASE_DEVICE_ID = 90000000
+
+
+def percentiles(values):
+    if not values:
+        return {"p50_ms": 0, "p95_ms": 0, "p99_ms": 0}
+    ordered = sorted(values)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000
+    return {"p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99)}
+
+
+def provision_tills(api, count):
+    """Registers `count` devices and opens their fiscal day"""
+    device_ids = []
+    for i in range(count):
+        device_id = BASE_DEVICE_ID + i + 1
+        keys = requests.post(f"{api}/setup/generate-keys",
+                             json={"deviceID": device_id, "serialNumber": f"BENCH-POS-{i + 1:03d}"}).json()
+        if keys.get('status') != 'success':
+            raise SystemExit(f"Key generation failed for {device_id}: {keys}")
+        registered = requests.post(f"{api}/setup/register", json={"deviceID": device_id, "csr": keys['csr']}).json()
+        if registered.get('status') != 'success':
+            raise SystemExit(f"Registration failed for {device_id} (is mock_zimra.py running?): {registered}")
+        requests.post(f"{api}/day/open", json={"deviceID": device_id})
+        device_ids.append(device_id)
+    return device_ids
+
+
+def build_cart(items):
+    return [{
+        "id": str(n),
+        "name": f"Bench Item {n}",
+        "price": 1.25 + n,
+        "quantity": 1 + n % 3,
+        "taxRate": 0.15,
+        "taxInclusive": True
+    } for n in range(items)]
+
+
+def run_till(api, device_id, receipts, cart, latencies, errors):
+    session = requests.Session()
+    payload = {"deviceID": device_id, "currency": "USD", "items": cart}
+    for _ in range(receipts):
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{api}/submit-receipt", json=payload, timeout=30)
+            ok = response.status_code == 200 and response.json().get('status') == 'success'
+        except requests.exceptions.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        if ok:
+            latencies.append(elapsed)
+        else:
+            errors.append(elapsed)
+
+
+def wait_for_outbox(api, timeout):
+    """Seconds until every queued receipt was reported, or None on timeout"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if requests.get(f"{api}/outbox/status").json().get('queued', 0) == 0:
+            return time.perf_counter() - started
+        time.sleep(0.25)
+    return None
+
+
+def run(args):
+    api = args.url.rstrip('/') + '/api'
+    device_ids = provision_tills(api, args.tills)
+    timings_available = requests.delete(f"{api}/debug/timings").status_code == 200
+    cart = build_cart(args.items)
+
+    latencies, errors = [], []
+    threads = [threading.Thread(target=run_till, args=(api, device_id, args.receipts, cart, latencies, errors))
+               for device_id in device_ids]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    drain_seconds = wait_for_outbox(api, args.drain_timeout)
+    stages = requests.get(f"{api}/debug/timings").json().get('stages', {}) if timings_available else {}
+
+    return {
+        "tills": args.tills,
+        "receipts": len(latencies) + len(errors),
+        "items_per_receipt": args.items,
+        "errors": len(errors),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0,
+        "latency": percentiles(latencies),
+        "outbox_drain_s": drain_seconds,
+        "stages": stages
+    }
+
+
+def print_report(result):
+    print(f"Tills: {result['tills']}  Receipts: {result['receipts']}  Errors: {result['errors']}  "
+          f"Items/receipt: {result['items_per_receipt']}")
+    print(f"Throughput: {result['throughput_rps']:.1f} receipts/s over {result['elapsed_s']:.2f}s")
+    latency = result['latency']
+    print(f"Checkout latency: p50 {latency['p50_ms']:.1f}ms  p95 {latency['p95_ms']:.1f}ms  "
+          f"p99 {latency['p99_ms']:.1f}ms")
+    drain = result['outbox_drain_s']
+    print(f"Outbox drained {'in %.2fs' % drain if drain is not None else 'NOT within timeout'} after the run")
+    if not result['stages']:
+        print("Stage timings unavailable (start the backend with STAGE_TIMINGS=1)")
+        return
+    print(f"{'stage':<10} {'count':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, summary in result['stages'].items():
+        print(f"{name:<10} {summary['count']:>8} {summary['p50_ms']:>9.2f} "
+              f"{summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f}")
+
+
+def regressions(result, baseline, tolerance):
+    found = []
+    if result['throughput_rps'] < baseline['throughput_rps'] * (1 - tolerance):
+        found.append(f"throughput {result['throughput_rps']:.1f} < baseline {baseline['throughput_rps']:.1f}")
+    if result['latency']['p95_ms'] > baseline['latency']['p95_ms'] * (1 + tolerance):
+        found.append(f"p95 {result['latency']['p95_ms']:.1f}ms > baseline {baseline['latency']['p95_ms']:.1f}ms")
+    if result['errors'] > baseline.get('errors', 0):
+        found.append(f"{result['errors']} errors > baseline {baseline.get('errors', 0)}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000', help='Backend base URL.')
+    parser.add_argument('--tills', type=int, default=10, help='Concurrent simulated tills (devices).')
+    parser.add_argument('--receipts', type=int, default=50, help='Receipts per till.')
+    parser.add_argument('--items', type=int, default=3, help='Cart lines per receipt.')
+    parser.add_argument('--drain-timeout', type=float, default=60, help='Seconds to wait for the outbox.')
+    parser.add_argument('--json', dest='json_path', help='Also write the result as JSON here.')
+    parser.add_argument('--baseline', help='Result JSON to compare against; exit 1 on regression.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression.')
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        if found:
+            print("REGRESSION: " + "; ".join(found))
+            sys.exit(1)
+        print("No regression against baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Local stand-in for the ZIMRA fiscal server (FDMS).
+
+Implements the three calls the backend makes - LookupDeviceID,
+IssueCertificate and SubmitReciept - with configurable latency, error rate
+and throttling, so the POS and the benchmark can run without the real
+service:
+
+    python mock_zimra.py --latency-ms 80 --jitter-ms 40 --error-rate 0.02 --rate-limit 200
+"""
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from flask import Flask, jsonify, request
+
+
+class Behaviour:
+    """Latency, failures and throttling applied to every fiscal call"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, rate_limit=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self._lock = threading.Lock()
+        self._tokens = float(rate_limit)
+        self._refilled_at = time.monotonic()
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0, "receipts": 0}
+
+    def _take_token(self):
+        # Token bucket holding at most one second's worth of requests
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled_at) * self.rate_limit)
+        self._refilled_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def apply(self):
+        """Returns an error response to send instead, or None to carry on"""
+        with self._lock:
+            self.stats["requests"] += 1
+            if not self._take_token():
+                self.stats["throttled"] += 1
+                return jsonify({"title": "Too Many Requests"}), 429
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if random.random() < self.error_rate:
+            self.count("errors")
+            return jsonify({"title": "Simulated Server Error"}), 503
+        return None
+
+
+def create_mock_app(behaviour=None):
+    app = Flask(__name__)
+    behaviour = behaviour or Behaviour()
+
+    # Self-signed "ZIMRA" CA used to issue device certificates
+    ca_key = ec.generate_private_key(ec.SECP256R1())
+    ca_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u"Mock ZIMRA FDMS CA")])
+    # Like FDMS, a serial number always maps to the same device ID
+    device_ids = {}
+    id_lock = threading.Lock()
+
+    @app.route('/Public/v1/LookupDeviceID', methods=['POST'])
+    def lookup_device_id():
+        error = behaviour.apply()
+        if error:
+            return error
+        serial_no = (request.json or {}).get('serialNumber')
+        if not serial_no:
+            return jsonify({"title": "serialNumber is required"}), 400
+        with id_lock:
+            device_id = device_ids.setdefault(serial_no, 72000001 + len(device_ids))
+        return jsonify({"deviceID": device_id})
+
+    @app.route('/Device/v1/IssueCertificate', methods=['POST'])
+    def issue_certificate():
+        error = behaviour.apply()
+        if error:
+            return error
+        data = request.json or {}
+        try:
+            csr = x509.load_pem_x509_csr(data.get('csr', '').encode('utf-8'))
+        except ValueError:
+            return jsonify({"title": "Invalid CSR"}), 400
+        now = datetime.now(timezone.utc)
+        certificate = (x509.CertificateBuilder()
+                       .subject_name(csr.subject)
+                       .issuer_name(ca_name)
+                       .public_key(csr.public_key())
+                       .serial_number(x509.random_serial_number())
+                       .not_valid_before(now)
+                       .not_valid_after(now + timedelta(days=365))
+                       .sign(ca_key, hashes.SHA256()))
+        return jsonify({
+            "deviceID": data.get('deviceid'),
+            "certificate": certificate.public_bytes(serialization.Encoding.PEM).decode('utf-8')
+        })
+
+    @app.route('/Device/v1/<device_id>/SubmitReciept', methods=['POST'])
+    def submit_receipt(device_id):
+        error = behaviour.apply()
+        if error:
+            return error
+        receipt = request.json or {}
+        device_signature = receipt.get('receiptDeviceSignature', {})
+        if not device_signature.get('hash') or not device_signature.get('signature'):
+            return jsonify({"title": "Missing receiptDeviceSignature"}), 422
+        behaviour.count("receipts")
+        server_signature = ca_key.sign(device_signature['hash'].encode('utf-8'), ec.ECDSA(hashes.SHA256()))
+        return jsonify({
+            "receiptID": random.randint(1, 10 ** 9),
+            "serverDate": datetime.now().isoformat(),
+            "receiptServerSignature": {"signature": server_signature.hex()}
+        })
+
+    @app.route('/stats', methods=['GET'])
+    def stats():
+        return jsonify(behaviour.stats)
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=4000)
+    parser.add_argument('--latency-ms', type=float, default=0, help='Added to every call.')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Random +/- spread on the latency.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls answered with 503.')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Requests/second before 429s (0 = off).')
+    args = parser.parse_args()
+
+    mock = create_mock_app(Behaviour(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit))
+    mock.run(port=args.port, threaded=True)
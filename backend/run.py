@@ -1,6 +1,8 @@
 from app import create_app
 
-app = create_app()
+# Crypto pool workers re-import this script as __mp_main__ and need no app of their own
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     # The application factory in __init__.py already handles db.create_all()
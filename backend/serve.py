@@ -0,0 +1,38 @@
+"""Production server: the API under uvicorn with several worker processes.
+
+    python serve.py --workers 4 --port 5000
+
+Each worker handles regular requests on a pool of WEB_THREADS threads and
+keeps the tills' status streams on its event loop. Receipts queued by any
+worker are delivered to ZIMRA by this supervising process only, so no receipt
+is ever submitted twice and the per-device order is kept.
+"""
+import argparse
+import os
+
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=os.environ.get('WEB_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('WEB_PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1)),
+                        help='Worker processes (default: WEB_CONCURRENCY or the CPU count).')
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        from app import create_app
+
+        # Drain the outbox here; the workers (spawned with this environment) leave it alone
+        outbox_app = create_app()
+        worker = outbox_app.extensions.get('outbox')
+        if worker:
+            worker.ensure_started()
+        os.environ['OUTBOX_WORKER'] = '0'
+
+    uvicorn.run('asgi:app', host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db, fiscal_core, gateway, sequencer  # noqa: E402
+from app.models import DeviceConfig  # noqa: E402
+
+DEVICE_ID = "72000001"
+
+
+@pytest.fixture
+def app_config(tmp_path, monkeypatch):
+    """Config overrides pointing the app at a throwaway database and keys folder"""
+    keys_dir = tmp_path / 'keys'
+    keys_dir.mkdir()
+    monkeypatch.setattr(fiscal_core, 'KEYS_DIR', str(keys_dir))
+    monkeypatch.setattr(gateway, 'KEYS_DIR', str(keys_dir))
+    return {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'fiscal.db'}",
+        "ARCHIVE_DIR": str(tmp_path / 'archive'),
+        "OUTBOX_WORKER_ENABLED": False,
+        "PREWARM_SIGNING_KEYS": False,
+    }
+
+
+@pytest.fixture
+def make_app(app_config):
+    apps = []
+
+    def make(**overrides):
+        app = create_app({**app_config, **overrides})
+        apps.append(app)
+        return app
+    yield make
+
+    # Module level state outlives the app
+    sequencer.reset()
+    fiscal_core.invalidate_private_key()
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def device(app):
+    """A registered device with its signing key (no ZIMRA round trip)"""
+    with app.app_context():
+        fiscal_core.generate_device_keys(DEVICE_ID)
+        db.session.add(DeviceConfig(device_id=DEVICE_ID, serial_number="TEST-001", certificate=None,
+                                    is_registered=True))
+        db.session.commit()
+    return DEVICE_ID
+
+
+@pytest.fixture
+def open_day(client, device):
+    response = client.post('/api/day/open', json={"deviceID": device})
+    assert response.status_code == 200, response.json
+    return response.json['fiscalDayNo']
+
+
+@pytest.fixture
+def sell(client, device):
+    """Posts a single-total sale for the device, optionally with an Idempotency-Key"""
+    def post(amount=5.80, key=None):
+        headers = {"Idempotency-Key": key} if key else {}
+        return client.post('/api/submit-receipt', json={"deviceID": device, "totalAmount": amount},
+                           headers=headers)
+    return post
@@ -0,0 +1,95 @@
+import gc
+import gzip
+import os
+
+import pytest
+
+from app import archive, db
+from app.models import DayArchive, FiscalDay, Receipt, ReceiptLine, ReceiptSubmission
+
+
+@pytest.fixture
+def archived(app, client, device, open_day, sell):
+    """Two closed, reported and archived days of three receipts, then an open day"""
+    for day in range(2):
+        for _ in range(3):
+            sell()
+        client.post('/api/day/close', json={"deviceID": device})
+        client.post('/api/day/open', json={"deviceID": device})
+    sell()
+    with app.app_context():
+        ReceiptSubmission.query.update({"status": "Reported"})
+        db.session.commit()
+
+    response = client.post('/api/archive/run', json={"deviceID": device, "keep": 0})
+    assert [d['status'] for d in response.json['days']] == ["archived", "archived"]
+    with app.app_context():
+        return {seal.fiscal_day_no: os.path.join(app.config['ARCHIVE_DIR'], seal.path)
+                for seal in DayArchive.query}
+
+
+def _tamper(path, old, new):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        content = f.read()
+    assert old in content
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(content.replace(old, new, 1))
+
+
+def test_archived_days_read_back(app, client, device, archived):
+    with app.app_context():
+        assert Receipt.query.count() == 1
+
+    audit = client.get(f'/api/audit/verify?deviceID={device}').json['audit']
+    export = client.get(f'/api/receipts/export?format=csv&deviceID={device}').data.decode().splitlines()
+    receipt = client.get(f'/api/receipt/2/status?deviceID={device}').json
+
+    assert audit['ok'] and audit['checked'] == 7
+    assert len(export) == 1 + 7
+    assert receipt['archived'] and receipt['server_status'] == "Reported"
+    assert (receipt['deviceID'], receipt['globalNo']) == (device, 2)
+    assert client.get(f'/api/receipt/2/status?deviceID=72000002').status_code == 404
+
+
+def test_tampered_archive_is_never_served(client, device, archived):
+    _tamper(archived[1], '"status":"Reported"', '"status":"TAMPERED"')
+
+    receipt = client.get(f'/api/receipt/2/status?deviceID={device}')
+    export = client.get(f'/api/receipts/export?format=jsonl&deviceID={device}')
+    audit = client.get(f'/api/audit/verify?deviceID={device}')
+
+    assert receipt.status_code == 500 and "does not match its seal" in receipt.json['message']
+    assert export.status_code == 500 and "TAMPERED" not in export.data.decode()
+    assert audit.status_code == 500
+
+
+def test_export_checks_every_archive_before_streaming(client, device, archived):
+    # Day 1 is intact and would be streamed first
+    _tamper(archived[2], '"status":"Reported"', '"status":"TAMPERED"')
+
+    export = client.get(f'/api/receipts/export?format=csv&deviceID={device}')
+
+    assert export.status_code == 500
+    assert export.is_json
+
+
+
+def test_archiving_releases_the_rows_it_has_written(app, client, device, open_day, sell, monkeypatch):
+    for _ in range(5):
+        sell()
+    client.post('/api/day/close', json={"deviceID": device})
+    monkeypatch.setattr(archive, 'ARCHIVE_BATCH_SIZE', 2)
+
+    with app.app_context():
+        day = FiscalDay.query.filter_by(device_id=device, fiscal_day_no=open_day).one()
+        # With the cycle collector off, anything left here is still held by the session
+        gc.disable()
+        try:
+            written = [receipt.global_no for receipt in archive._day_receipts(day)]
+            held = [obj for obj in db.session.identity_map.values()
+                    if isinstance(obj, (Receipt, ReceiptLine, ReceiptSubmission))]
+        finally:
+            gc.enable()
+
+    assert written == [1, 2, 3, 4, 5]
+    assert held == []
@@ -0,0 +1,66 @@
+from app import db
+from app.models import DeviceKey, Receipt, ReceiptSubmission
+
+
+def _rekey(client, device):
+    response = client.post('/api/setup/generate-keys', json={"deviceID": device, "serialNumber": "TEST-001"})
+    assert response.status_code == 200
+
+
+def _audit(client, device):
+    return client.get(f'/api/audit/verify?deviceID={device}').json['audit']
+
+
+def test_receipts_signed_before_a_rekey_still_verify(app, client, device, open_day, sell):
+    for _ in range(3):
+        sell()
+    _rekey(client, device)
+    sell()
+
+    audit = _audit(client, device)
+
+    assert audit['ok'] and audit['checked'] == 4 and audit['badSignatures'] == 0
+    with app.app_context():
+        assert DeviceKey.query.filter_by(device_id=device).count() == 2
+        fingerprints = [r.key_fingerprint for r in Receipt.query.order_by(Receipt.global_no)]
+        assert fingerprints[0] == fingerprints[2] != fingerprints[3]
+
+
+def test_archived_receipts_keep_their_signing_key(app, client, device, open_day, sell):
+    for _ in range(2):
+        sell()
+    client.post('/api/day/close', json={"deviceID": device})
+    _rekey(client, device)
+    client.post('/api/day/open', json={"deviceID": device})
+    sell()
+    with app.app_context():
+        ReceiptSubmission.query.update({"status": "Reported"})
+        db.session.commit()
+    assert client.post('/api/archive/run', json={"deviceID": device, "keep": 0}).json['days'][0]['status'] == "archived"
+
+    audit = _audit(client, device)
+
+    assert audit['ok'] and audit['checked'] == 3
+
+
+def test_signature_from_another_key_is_still_caught(app, client, device, open_day, sell):
+    sell()
+    sell()
+    with app.app_context():
+        first, second = Receipt.query.order_by(Receipt.global_no).all()
+        first.signature = second.signature
+        db.session.commit()
+
+    audit = _audit(client, device)
+
+    assert audit['badSignatures'] == 1 and audit['firstBreak'] == {"globalNo": 1, "reason": "signature"}
+
+
+def test_receipts_from_before_keys_were_recorded_use_the_current_key(app, client, device, open_day, sell):
+    sell()
+    with app.app_context():
+        Receipt.query.update({"key_fingerprint": None})
+        DeviceKey.query.delete()
+        db.session.commit()
+
+    assert _audit(client, device)['ok']
@@ -0,0 +1,52 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from app.export import EXPORT_COLUMNS
+
+
+def _sales(client, device, sell):
+    sell(5.80)
+    sell(0.29)
+    client.post('/api/day/close', json={"deviceID": device})
+    client.post('/api/day/open', json={"deviceID": device})
+    sell(10.01)
+
+
+def test_csv_export_has_a_header_and_one_row_per_receipt(client, device, open_day, sell):
+    _sales(client, device, sell)
+
+    response = client.get(f'/api/receipts/export?format=csv&deviceID={device}')
+
+    assert response.status_code == 200 and response.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(response.data.decode())))
+    assert rows[0] == EXPORT_COLUMNS
+    records = [dict(zip(EXPORT_COLUMNS, row)) for row in rows[1:]]
+    assert [(r['device_id'], r['fiscal_day_no'], r['global_no'], r['total_amount']) for r in records] == [
+        (device, '1', '1', '5.8'), (device, '1', '2', '0.29'), (device, '2', '3', '10.01')]
+    assert records[1]['previous_hash'] == records[0]['receipt_hash']
+
+
+def test_jsonl_export_has_one_object_per_receipt(client, device, open_day, sell):
+    _sales(client, device, sell)
+
+    response = client.get(f'/api/receipts/export?format=jsonl&deviceID={device}&fiscalDayNo=1')
+
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [list(r) for r in records] == [EXPORT_COLUMNS] * 2
+    assert [(r['global_no'], r['total_amount'], r['invoice_no']) for r in records] == [
+        (1, 5.8, "INV-000001"), (2, 0.29, "INV-000002")]
+    # Dates are written as ISO strings
+    assert datetime.fromisoformat(records[0]['date_created']).date() == date.today()
+
+
+def test_export_date_range_filters_receipts(client, device, open_day, sell):
+    _sales(client, device, sell)
+
+    empty = client.get(f'/api/receipts/export?format=jsonl&deviceID={device}&from=2100-01-01')
+    bad = client.get(f'/api/receipts/export?format=xml&deviceID={device}')
+
+    assert empty.status_code == 200 and empty.data == b""
+    assert bad.status_code == 400
@@ -0,0 +1,76 @@
+import base64
+
+import pytest
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from app import db
+from app.fiscal_core import (BULK_SIGN_PROCESS_THRESHOLD, amount_to_cents, calculate_hash, get_crypto_pool,
+                             get_private_key, get_private_key_path, sign_receipts, write_file_atomic)
+from app.models import Receipt
+
+
+@pytest.mark.parametrize("amount, cents", [(0.29, 29), (10.01, 1001), (0.57, 57), (1.15, 115), (5.80, 580)])
+def test_amount_to_cents_is_exact(amount, cents):
+    assert amount_to_cents(amount) == cents
+
+
+def test_hash_uses_the_exact_cents():
+    assert (calculate_hash("1", 1, 1, 29, "0", "20240102100000")
+            == calculate_hash("1", 1, 1, amount_to_cents(0.29), "0", "20240102100000"))
+    assert calculate_hash("1", 1, 1, 29, "0", "20240102100000") != calculate_hash("1", 1, 1, 28, "0", "20240102100000")
+
+
+@pytest.mark.parametrize("amount", [0.29, 10.01])
+def test_receipt_hash_covers_the_exact_amount(app, client, device, open_day, sell, amount):
+    response = sell(amount)
+
+    with app.app_context():
+        receipt = Receipt.query.one()
+        expected = calculate_hash(device, receipt.fiscal_day_no, receipt.global_no, round(amount * 100),
+                                  receipt.previous_hash, response.json['date'])
+        assert receipt.receipt_hash == expected
+    audit = client.get(f'/api/audit/verify?deviceID={device}').json['audit']
+    assert audit['ok'] and audit['legacyHashes'] == 0
+
+
+def test_audit_catches_an_amount_changed_by_a_cent(app, client, device, open_day, sell):
+    sell(0.29)
+    with app.app_context():
+        Receipt.query.one().total_amount = 0.28
+        db.session.commit()
+
+    audit = client.get(f'/api/audit/verify?deviceID={device}').json['audit']
+    assert not audit['ok'] and audit['firstBreak'] == {"globalNo": 1, "reason": "hash"}
+
+
+def _rotate_elsewhere(device_id):
+    """Writes a new key file the way another worker's generate_device_keys would (this process isn't told)"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    write_file_atomic(get_private_key_path(device_id), key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()))
+    return key
+
+
+def test_key_rotated_by_another_process_is_picked_up(device):
+    old_key = get_private_key(device)
+
+    new_key = _rotate_elsewhere(device)
+
+    assert get_private_key(device).public_key() == new_key.public_key()
+    assert get_private_key(device).public_key() != old_key.public_key()
+
+
+def test_cached_key_is_reused_while_the_file_is_unchanged(device):
+    assert get_private_key(device) is get_private_key(device)
+
+
+def test_bulk_signing_workers_are_not_forked_from_the_server(device):
+    receipt_hashes = [f"hash-{n}" for n in range(BULK_SIGN_PROCESS_THRESHOLD)]
+
+    signatures = sign_receipts(device, receipt_hashes)
+
+    assert get_crypto_pool()._mp_context.get_start_method() != 'fork'
+    public_key = get_private_key(device).public_key()
+    for receipt_hash, signature in zip(receipt_hashes, signatures):
+        public_key.verify(base64.b64decode(signature), receipt_hash.encode('utf-8'), ec.ECDSA(hashes.SHA256()))
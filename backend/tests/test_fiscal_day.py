@@ -0,0 +1,36 @@
+import threading
+
+from app import db
+from app.fiscal_day import record_receipts
+
+
+def test_close_waits_for_a_sale_another_process_is_committing(app, client, device, open_day, sell, make_app):
+    sell()
+    # A second app has its own engine and connections, like another worker process
+    other = make_app().test_client()
+
+    with app.app_context():
+        # A sale in flight elsewhere: counted into the day but not committed yet
+        record_receipts(device, open_day, [{"currency": "ZWG", "global_no": 2, "hash": "h2",
+                                            "taxes": {"STANDARD": (1000, 130)}}])
+        db.session.flush()
+
+        closed = {}
+        closing = threading.Thread(target=lambda: closed.update(
+            response=other.post('/api/day/close', json={"deviceID": device})))
+        closing.start()
+        closing.join(0.5)
+        assert closing.is_alive()
+        db.session.commit()
+    closing.join(10)
+
+    report = closed['response'].json['report']
+    totals = {t['taxCategory']: t for t in report['totals']}
+    assert report['receiptCount'] == 2
+    assert totals['ALL']['receiptCount'] == 2
+    assert totals['STANDARD']['salesAmount'] == 10 + 5.80
+
+
+def test_sale_after_close_is_refused(client, device, open_day, sell):
+    client.post('/api/day/close', json={"deviceID": device})
+    assert sell().status_code == 400
@@ -0,0 +1,71 @@
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from app import db
+from app.fiscal_core import get_private_key_path, write_file_atomic
+from app.gateway import certificate_path, get_gateway, store_certificate
+from app.models import DeviceConfig
+from app.timing import timer
+
+
+def _certify(app, device_id, certificate):
+    with app.app_context():
+        DeviceConfig.query.filter_by(device_id=device_id).one().certificate = certificate
+        db.session.commit()
+
+
+def test_session_is_reused_while_credentials_are_unchanged(app, device):
+    _certify(app, device, "CERT-1")
+    with app.app_context():
+        gateway = get_gateway()
+        session = gateway.session_for(device)
+
+        assert session.cert == (certificate_path(device), get_private_key_path(device))
+        assert gateway.session_for(device) is session
+        # Storing the same certificate again doesn't disturb anyone's session
+        store_certificate(device, "CERT-1")
+        assert gateway.session_for(device) is session
+
+
+def test_certificate_issued_by_another_process_rebuilds_the_session(app, device):
+    with app.app_context():
+        gateway = get_gateway()
+        session = gateway.session_for(device)
+        assert session.cert is None
+
+    # Another worker registers the device: new certificate in the database and on disk
+    _certify(app, device, "CERT-2")
+    store_certificate(device, "CERT-2")
+
+    with app.app_context():
+        rebuilt = gateway.session_for(device)
+        assert rebuilt is not session
+        assert rebuilt.cert == (certificate_path(device), get_private_key_path(device))
+    with open(certificate_path(device)) as f:
+        assert f.read() == "CERT-2"
+
+
+def test_key_rotated_by_another_process_rebuilds_the_session(app, device):
+    _certify(app, device, "CERT-1")
+    with app.app_context():
+        gateway = get_gateway()
+        session = gateway.session_for(device)
+
+        key = ec.generate_private_key(ec.SECP256R1())
+        write_file_atomic(get_private_key_path(device), key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption()))
+
+        assert gateway.session_for(device) is not session
+
+
+def test_setup_calls_are_timed_as_upstream(app, monkeypatch):
+    timer.reset()
+    with app.app_context():
+        gateway = get_gateway()
+        monkeypatch.setattr(gateway.session_for(), 'post', lambda url, **kwargs: url)
+
+        gateway.lookup_device_id("POS-001")
+        gateway.issue_certificate("72000001", "CSR")
+
+    assert timer.snapshot()['upstream']['count'] == 2
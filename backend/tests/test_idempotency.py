@@ -0,0 +1,75 @@
+from app import db
+from app.idempotency import get_cache
+from app.models import Receipt, ReceiptSubmission
+
+
+def _deliver(app, global_no):
+    with app.app_context():
+        submission = ReceiptSubmission.query.filter_by(global_no=global_no).one()
+        submission.status = "Reported"
+        db.session.commit()
+
+
+def test_retry_returns_the_original_receipt(app, open_day, sell):
+    first = sell(5.80, key="k1")
+
+    retry = sell(5.80, key="k1")
+
+    assert retry.status_code == 200
+    assert retry.json == first.json
+    with app.app_context():
+        assert Receipt.query.count() == 1
+
+
+def test_key_reused_for_a_different_cart_is_refused(app, open_day, sell):
+    sell(5.80, key="k1")
+
+    response = sell(9.99, key="k1")
+
+    assert response.status_code == 422
+    assert "k1" in response.json['message']
+    with app.app_context():
+        assert Receipt.query.count() == 1
+
+
+def test_key_reused_for_a_different_cart_is_refused_after_eviction(app, open_day, sell):
+    sell(5.80, key="k1")
+    get_cache(app).clear()
+
+    assert sell(9.99, key="k1").status_code == 422
+    assert sell(5.80, key="k1").status_code == 200
+
+
+def test_key_reused_in_a_batch_is_refused(app, client, device, open_day, sell):
+    sell(5.80, key="k1")
+
+    response = client.post('/api/submit-receipts', json={"deviceID": device, "receipts": [
+        {"totalAmount": 1.00, "clientReceiptId": "k2"},
+        {"totalAmount": 9.99, "clientReceiptId": "k1"}]})
+
+    assert response.status_code == 422
+    with app.app_context():
+        assert Receipt.query.count() == 1
+
+
+def test_replay_reports_the_current_delivery_state(app, open_day, sell):
+    assert sell(5.80, key="k1").json['verification']['server_status'] == "Queued"
+    _deliver(app, 1)
+
+    # Answered from the replay cache, and again from the database once evicted
+    assert sell(5.80, key="k1").json['verification']['server_status'] == "Reported"
+    get_cache(app).clear()
+    assert sell(5.80, key="k1").json['verification']['server_status'] == "Reported"
+
+
+def test_receipts_keyed_before_fingerprints_still_replay(app, open_day, sell):
+    sell(5.80, key="k1")
+    with app.app_context():
+        Receipt.query.one().idempotency_fingerprint = None
+        db.session.commit()
+    get_cache(app).clear()
+
+    response = sell(5.80, key="k1")
+
+    assert response.status_code == 200
+    assert response.json['globalNo'] == 1
@@ -0,0 +1,44 @@
+import re
+
+from app import db
+from app.metrics import STAGE_SECONDS
+from app.models import ReceiptSubmission
+
+
+def _samples(text, name):
+    """{labels string: value} for the lines of one metric"""
+    return {labels: float(value) for labels, value in
+            re.findall(rf'^{name}(\{{[^}}]*\}})? (\S+)$', text, re.MULTILINE)}
+
+
+def test_stage_histogram_is_cumulative(client):
+    for seconds in (0.0003, 0.003, 0.3):
+        STAGE_SECONDS.observe(seconds, "test_render")
+
+    text = client.get('/api/metrics').data.decode()
+
+    buckets = [(labels, value) for labels, value in _samples(text, 'zimra_stage_seconds_bucket').items()
+               if 'stage="test_render"' in labels]
+    counts = [value for _, value in buckets]
+    assert counts == sorted(counts)
+    by_bound = {re.search(r'le="([^"]+)"', labels).group(1): value for labels, value in buckets}
+    assert (by_bound['0.0005'], by_bound['0.005'], by_bound['0.5'], by_bound['+Inf']) == (1, 2, 3, 3)
+    assert _samples(text, 'zimra_stage_seconds_count')['{stage="test_render"}'] == 3
+    assert abs(_samples(text, 'zimra_stage_seconds_sum')['{stage="test_render"}'] - 0.3033) < 1e-9
+
+
+def test_outbox_gauges_count_every_state(app, client, open_day, sell):
+    for _ in range(4):
+        sell()
+    with app.app_context():
+        submissions = ReceiptSubmission.query.order_by(ReceiptSubmission.global_no).all()
+        submissions[0].status = "Reported"
+        submissions[1].status = "Rejected"
+        submissions[2].attempts = 2
+        db.session.commit()
+
+    text = client.get('/api/metrics').data.decode()
+
+    assert _samples(text, 'zimra_outbox_receipts') == {
+        '{status="Queued"}': 2, '{status="Reported"}': 1, '{status="Rejected"}': 1}
+    assert _samples(text, 'zimra_outbox_failing_receipts') == {'': 1}
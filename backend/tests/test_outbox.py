@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db, fiscal_core
+from app.models import DeviceConfig, ReceiptSubmission
+from app.outbox import OutboxWorker
+
+SLOW_DEVICE = "72000099"
+
+
+class FakeResponse:
+    status_code = 200
+    text = ""
+
+    def json(self):
+        return {"receiptServerSignature": {"signature": "SERVER"}}
+
+
+class FakeGateway:
+    """Answers every receipt at once, except for the slow device until `release` is set"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def submit_receipt(self, device_id, payload):
+        if device_id == SLOW_DEVICE:
+            self.release.wait(10)
+        return FakeResponse()
+
+
+def _wait_for(app, predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with app.app_context():
+            if predicate():
+                return True
+        time.sleep(0.02)
+    return False
+
+
+def _reported(device_id):
+    return [s.global_no for s in ReceiptSubmission.query.filter_by(device_id=device_id, status="Reported")
+            .order_by(ReceiptSubmission.reported_at, ReceiptSubmission.id)]
+
+
+@pytest.fixture
+def two_devices(app, client, device, open_day, sell):
+    with app.app_context():
+        fiscal_core.generate_device_keys(SLOW_DEVICE)
+        db.session.add(DeviceConfig(device_id=SLOW_DEVICE, serial_number="TEST-099", is_registered=True))
+        db.session.commit()
+    client.post('/api/day/open', json={"deviceID": SLOW_DEVICE})
+    for n in range(5):
+        sell()
+        client.post('/api/submit-receipt', json={"deviceID": SLOW_DEVICE, "totalAmount": n + 1})
+    return device, SLOW_DEVICE
+
+
+def test_a_slow_device_does_not_hold_up_the_others(app, two_devices):
+    fast, slow = two_devices
+    gateway = FakeGateway()
+    app.extensions['zimra_gateway'] = gateway
+    worker = OutboxWorker(app)
+
+    with app.app_context():
+        worker.drain()
+    try:
+        assert _wait_for(app, lambda: len(_reported(fast)) == 5)
+        with app.app_context():
+            assert _reported(slow) == []
+    finally:
+        gateway.release.set()
+
+    assert _wait_for(app, lambda: len(_reported(slow)) == 5)
+    with app.app_context():
+        assert _reported(fast) == [1, 2, 3, 4, 5]
+        assert _reported(slow) == [1, 2, 3, 4, 5]
+
+
+def test_device_queue_is_read_in_pages(app, device, open_day, sell):
+    for _ in range(7):
+        sell()
+    gateway = FakeGateway()
+    app.extensions['zimra_gateway'] = gateway
+    app.config['OUTBOX_PAGE_SIZE'] = 3
+    worker = OutboxWorker(app)
+
+    with app.app_context():
+        assert worker._drain_device(device) == 7
+        assert _reported(device) == [1, 2, 3, 4, 5, 6, 7]
+
+
+class StatusGateway:
+    """Answers every receipt with the given HTTP status"""
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.sent = []
+
+    def submit_receipt(self, device_id, payload):
+        self.sent.append(json.loads(payload)['receiptGlobalNo'])
+        response = FakeResponse()
+        response.status_code = self.status_code
+        return response
+
+
+@pytest.mark.parametrize("status_code", [401, 403])
+def test_certificate_refusal_pauses_the_device_instead_of_rejecting(app, device, open_day, sell, status_code):
+    for _ in range(3):
+        sell()
+    gateway = StatusGateway(status_code)
+    app.extensions['zimra_gateway'] = gateway
+    worker = OutboxWorker(app)
+
+    with app.app_context():
+        assert worker._drain_device(device) == 0
+        assert gateway.sent == [1]
+        statuses = [(s.status, s.attempts) for s in ReceiptSubmission.query.order_by(ReceiptSubmission.global_no)]
+        assert statuses == [("Queued", 1), ("Queued", 0), ("Queued", 0)]
+        assert ReceiptSubmission.query.filter_by(global_no=1).one().next_attempt_at > datetime.now()
+
+
+def test_device_waiting_out_a_backoff_is_not_picked_up(app, device, open_day, sell, monkeypatch):
+    for _ in range(2):
+        sell()
+    with app.app_context():
+        # Only the oldest receipt is backing off; the one behind it looks due
+        head = ReceiptSubmission.query.filter_by(global_no=1).one()
+        head.next_attempt_at = datetime.now() + timedelta(minutes=5)
+        db.session.commit()
+    started = []
+    worker = OutboxWorker(app)
+    monkeypatch.setattr(worker, '_run_device', started.append)
+
+    with app.app_context():
+        worker.drain()
+        assert started == []
+
+        head = ReceiptSubmission.query.filter_by(global_no=1).one()
+        head.next_attempt_at = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+        worker.drain()
+    assert _wait_for(app, lambda: started == [device])
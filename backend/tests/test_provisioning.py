@@ -0,0 +1,90 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import provisioning
+from app.gateway import get_gateway
+from app.models import DeviceConfig
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {}
+        self.text = str(self.body)
+
+    def json(self):
+        return self.body
+
+
+class FakeZimra:
+    """Hands out a fresh ID on every lookup and refuses certificates while `down`"""
+
+    def __init__(self):
+        self.ids = itertools.count(73000001)
+        self.lookups = 0
+        self.down = True
+
+    def lookup_device_id(self, serial_no):
+        self.lookups += 1
+        return FakeResponse(200, {"deviceID": next(self.ids)})
+
+    def issue_certificate(self, device_id, csr_pem):
+        if self.down:
+            return FakeResponse(503, {"error": "Simulated Server Error"})
+        return FakeResponse(200, {"certificate": f"CERT-{device_id}"})
+
+
+@pytest.fixture
+def zimra(app, monkeypatch):
+    fake = FakeZimra()
+    gateway = get_gateway(app)
+    monkeypatch.setattr(gateway, 'lookup_device_id', fake.lookup_device_id)
+    monkeypatch.setattr(gateway, 'issue_certificate', fake.issue_certificate)
+    # Keys are written in this process, into the test's keys folder
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(provisioning, 'get_crypto_pool', lambda: pool)
+    yield fake
+    pool.shutdown()
+
+
+def test_failed_registration_keeps_the_looked_up_id(app, client, zimra):
+    devices = {"devices": [{"serialNumber": "POS-001"}]}
+
+    first = client.post('/api/setup/provision', json=devices).json
+    assert first['failed'] == 1
+    device_id = first['devices'][0]['deviceID']
+    with app.app_context():
+        config = DeviceConfig.query.filter_by(device_id=device_id).one()
+        assert config.serial_number == "POS-001" and not config.is_registered
+
+    zimra.down = False
+    second = client.post('/api/setup/provision', json=devices).json
+
+    assert second['registered'] == 1
+    assert second['devices'][0]['deviceID'] == device_id
+    assert zimra.lookups == 1
+    with app.app_context():
+        config = DeviceConfig.query.one()
+        assert config.is_registered and config.certificate == f"CERT-{device_id}"
+
+
+def test_duplicate_device_ids_are_refused(client, zimra):
+    response = client.post('/api/setup/provision', json={"devices": [
+        {"serialNumber": "POS-001", "deviceID": 73000009},
+        {"serialNumber": "POS-002", "deviceID": "73000009"}]})
+
+    assert response.status_code == 400
+    assert response.json['message'] == "Device 2: duplicate deviceID 73000009"
+    assert zimra.lookups == 0
+
+
+def test_looked_up_id_clashing_with_a_given_one_fails(client, zimra):
+    zimra.down = False
+    response = client.post('/api/setup/provision', json={"devices": [
+        {"serialNumber": "POS-001", "deviceID": 73000001},
+        {"serialNumber": "POS-002"}]}).json
+
+    assert [d['status'] for d in response['devices']] == ["registered", "failed"]
+    assert "already used" in response['devices'][1]['message']
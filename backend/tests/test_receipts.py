@@ -0,0 +1,77 @@
+from datetime import datetime
+
+from app import db, fiscal_core
+from app.models import DeviceConfig, FiscalDay, Receipt, ReceiptSubmission
+
+
+def _change_day_elsewhere(app, device_id):
+    """Closes day 1 and opens day 2 the way another worker process would (this one isn't told)"""
+    with app.app_context():
+        config = DeviceConfig.query.filter_by(device_id=device_id).one()
+        FiscalDay.query.filter_by(device_id=device_id, fiscal_day_no=1).one().closed_at = datetime.now()
+        config.current_fiscal_day = 2
+        db.session.add(FiscalDay(device_id=device_id, fiscal_day_no=2))
+        db.session.commit()
+
+
+def test_sale_after_day_changed_elsewhere_is_issued_in_the_new_day(app, device, open_day, sell):
+    assert sell().json['globalNo'] == 1
+    _change_day_elsewhere(app, device)
+
+    response = sell(key="k1")
+
+    assert response.status_code == 200
+    assert response.json['globalNo'] == 2
+    with app.app_context():
+        receipts = Receipt.query.order_by(Receipt.global_no).all()
+        assert [(r.global_no, r.fiscal_day_no) for r in receipts] == [(1, 1), (2, 2)]
+        assert receipts[1].idempotency_key == "k1"
+        assert ReceiptSubmission.query.count() == 2
+        assert DeviceConfig.query.filter_by(device_id=device).one().last_global_no == 2
+
+
+def test_sale_after_day_changed_elsewhere_without_key(app, device, open_day, sell):
+    sell()
+    _change_day_elsewhere(app, device)
+
+    response = sell()
+
+    assert response.status_code == 200
+    assert response.json['globalNo'] == 2
+    with app.app_context():
+        assert Receipt.query.filter_by(fiscal_day_no=2).count() == 1
+
+
+def test_sale_after_day_closed_elsewhere_is_refused(app, device, open_day, sell):
+    sell()
+    with app.app_context():
+        FiscalDay.query.filter_by(device_id=device, fiscal_day_no=1).one().closed_at = datetime.now()
+        DeviceConfig.query.filter_by(device_id=device).one().is_day_open = False
+        db.session.commit()
+
+    response = sell(key="k2")
+
+    assert response.status_code == 400
+    with app.app_context():
+        assert Receipt.query.count() == 1
+
+
+def test_receipt_status_is_looked_up_per_device(app, client, device, open_day, sell):
+    other = "72000002"
+    with app.app_context():
+        fiscal_core.generate_device_keys(other)
+        db.session.add(DeviceConfig(device_id=other, serial_number="TEST-002", is_registered=True))
+        db.session.commit()
+    client.post('/api/day/open', json={"deviceID": other})
+    sell()
+    client.post('/api/submit-receipt', json={"deviceID": other, "totalAmount": 1.00})
+    with app.app_context():
+        ReceiptSubmission.query.filter_by(device_id=other).update({"status": "Reported"})
+        db.session.commit()
+
+    for device_id, server_status in ((device, "Queued"), (other, "Reported")):
+        response = client.get(f'/api/receipt/1/status?deviceID={device_id}').json
+        assert (response['deviceID'], response['globalNo'], response['server_status']) == (device_id, 1, server_status)
+
+    missing = client.get('/api/receipt/1/status')
+    assert missing.status_code == 400
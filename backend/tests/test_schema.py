@@ -0,0 +1,76 @@
+import sqlite3
+
+import pytest
+
+from app import fiscal_core
+from app.models import DeviceConfig, Receipt
+from app.schema import SchemaError
+
+# Tables as created by the first release (one global receipt sequence)
+LEGACY_SCHEMA = """
+CREATE TABLE device_config (
+    id INTEGER NOT NULL, device_id VARCHAR(50), serial_number VARCHAR(50), certificate TEXT,
+    is_registered BOOLEAN, current_fiscal_day INTEGER, is_day_open BOOLEAN, last_receipt_hash VARCHAR(500),
+    tax_payer_name VARCHAR(100), trade_name VARCHAR(100), bp_number VARCHAR(20), vat_number VARCHAR(20),
+    address VARCHAR(200), PRIMARY KEY (id), UNIQUE (device_id)
+);
+CREATE TABLE receipt (
+    id INTEGER NOT NULL, fiscal_day_no INTEGER NOT NULL, global_no INTEGER NOT NULL,
+    invoice_no VARCHAR(50) NOT NULL, total_amount FLOAT NOT NULL, tax_amount FLOAT NOT NULL,
+    previous_hash VARCHAR(500) NOT NULL, receipt_hash VARCHAR(500) NOT NULL, signature VARCHAR(1000) NOT NULL,
+    date_created DATETIME, PRIMARY KEY (id), UNIQUE (global_no)
+);
+"""
+
+
+def _legacy_database(app_config, device_ids=("72000001",), receipts=3):
+    connection = sqlite3.connect(app_config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):])
+    connection.executescript(LEGACY_SCHEMA)
+    for n, device_id in enumerate(device_ids, start=1):
+        connection.execute("INSERT INTO device_config (id, device_id, serial_number, is_registered, "
+                           "current_fiscal_day, is_day_open, last_receipt_hash) VALUES (?, ?, 'S', 1, 1, 1, ?)",
+                           (n, device_id, f"hash{receipts}"))
+    for global_no in range(1, receipts + 1):
+        connection.execute("INSERT INTO receipt (fiscal_day_no, global_no, invoice_no, total_amount, tax_amount, "
+                           "previous_hash, receipt_hash, signature, date_created) "
+                           "VALUES (1, ?, ?, 5.8, 0.76, ?, ?, 'sig', '2024-01-02 10:00:00.000000')",
+                           (global_no, f"INV-{global_no:06d}", f"hash{global_no - 1}", f"hash{global_no}"))
+    connection.commit()
+    connection.close()
+
+
+def test_legacy_database_is_upgraded_and_numbering_continues(app_config, make_app):
+    _legacy_database(app_config)
+    app = make_app()
+    with app.app_context():
+        fiscal_core.generate_device_keys("72000001")
+        assert DeviceConfig.query.one().last_global_no == 3
+        assert {(r.device_id, r.currency) for r in Receipt.query} == {("72000001", "ZWG")}
+
+    response = app.test_client().post('/api/submit-receipt', json={"deviceID": "72000001", "totalAmount": 1})
+
+    assert response.status_code == 200, response.json
+    assert response.json['globalNo'] == 4
+    with app.app_context():
+        assert Receipt.query.filter_by(global_no=4).one().previous_hash == "hash3"
+
+
+def test_upgrade_is_idempotent(app_config, make_app):
+    _legacy_database(app_config)
+    make_app()
+    app = make_app()
+    with app.app_context():
+        assert Receipt.query.count() == 3
+        assert DeviceConfig.query.one().last_global_no == 3
+
+
+def test_legacy_receipts_of_unknown_device_stop_startup(app_config, make_app):
+    _legacy_database(app_config, device_ids=("72000001", "72000002"))
+    with pytest.raises(SchemaError, match="LEGACY_RECEIPT_DEVICE_ID"):
+        make_app()
+
+    app = make_app(LEGACY_RECEIPT_DEVICE_ID="72000002")
+    with app.app_context():
+        assert {r.device_id for r in Receipt.query} == {"72000002"}
+        assert DeviceConfig.query.filter_by(device_id="72000002").one().last_global_no == 3
+        assert DeviceConfig.query.filter_by(device_id="72000001").one().last_global_no == 0
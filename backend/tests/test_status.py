@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import pytest
+
+from app.asgi import STATUS_STREAM_PATH, FiscalAsgiApp
+
+
+@pytest.fixture
+def app(make_app):
+    # Long enough that only an invalidation (never the TTL) can explain a pushed change
+    return make_app(STATUS_CACHE_TTL=30, STATUS_STREAM_KEEPALIVE=30)
+
+
+def _events(chunks):
+    """Parsed status events from SSE text (comments and retry lines are skipped)"""
+    events = []
+    for block in "".join(chunks).split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith((":", "retry")))
+        if fields.get('event') == "status":
+            events.append((fields['id'], json.loads(fields['data'])))
+    return events
+
+
+def test_unchanged_status_is_answered_with_304(client, device):
+    first = client.get(f'/api/device/status?deviceID={device}')
+    assert first.status_code == 200 and first.headers['ETag']
+
+    again = client.get(f'/api/device/status?deviceID={device}', headers={"If-None-Match": first.headers['ETag']})
+    assert again.status_code == 304 and not again.data
+
+    client.post('/api/day/open', json={"deviceID": device})
+    changed = client.get(f'/api/device/status?deviceID={device}', headers={"If-None-Match": first.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != first.headers['ETag'] and changed.json['is_day_open']
+
+
+def test_stream_pushes_the_status_again_once_invalidated(client, device):
+    response = client.get(f'{STATUS_STREAM_PATH}?deviceID={device}', buffered=False)
+    chunks = iter(response.response)
+    try:
+        assert next(chunks).decode() == "retry: 3000\n\n"
+        [(first_id, first)] = _events([next(chunks).decode()])
+        assert not first['is_day_open']
+
+        client.post('/api/day/open', json={"deviceID": device})
+
+        [(second_id, second)] = _events([next(chunks).decode()])
+        assert second['is_day_open'] and second_id != first_id
+    finally:
+        response.close()
+
+
+def test_asgi_stream_pushes_the_status_again_once_invalidated(app, client, device):
+    asgi = FiscalAsgiApp(app)
+    scope = {"type": "http", "method": "GET", "path": STATUS_STREAM_PATH,
+             "query_string": f"deviceID={device}".encode('latin1'), "headers": []}
+
+    async def run():
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        stream = asyncio.ensure_future(asgi(scope, inbox.get, outbox.put))
+
+        async def next_events():
+            while True:
+                message = await asyncio.wait_for(outbox.get(), 5)
+                if message['type'] == "http.response.start":
+                    assert message['status'] == 200
+                    continue
+                events = _events([message['body'].decode()])
+                if events:
+                    return events
+
+        [(_, first)] = await next_events()
+        assert not first['is_day_open']
+        # The day is opened through the Flask side, as a till's request would
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: client.post('/api/day/open', json={"deviceID": device}))
+        [(_, second)] = await next_events()
+        assert second['is_day_open']
+
+        await inbox.put({"type": "http.disconnect"})
+        await asyncio.wait_for(stream, 5)
+
+    asyncio.run(run())
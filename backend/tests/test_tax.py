@@ -0,0 +1,59 @@
+import pytest
+
+from app.tax import TaxError, calculate_receipt
+
+
+def test_exclusive_lines_are_stated_tax_inclusive():
+    bill = calculate_receipt([{"name": "Bread", "price": 1.10, "quantity": 3, "taxRate": 0.15,
+                               "taxInclusive": False}])
+    line = bill['lines'][0]
+
+    assert line['total_cents'] == 380
+    assert line['tax_cents'] == 50
+    assert line['unit_price_cents'] == 127   # 3.80 / 3, not the pre-tax 1.10
+
+
+def test_inclusive_lines_keep_their_price():
+    bill = calculate_receipt([{"name": "Milk", "price": 1.15, "quantity": 2, "taxRate": 0.15}])
+    line = bill['lines'][0]
+
+    assert (line['unit_price_cents'], line['total_cents'], line['tax_cents']) == (115, 230, 30)
+    assert bill['total_cents'] == 230 and bill['tax_cents'] == 30
+
+
+@pytest.mark.parametrize("rate", [15, 1.5])
+def test_percentage_tax_rates_are_refused(rate):
+    with pytest.raises(TaxError, match="fraction"):
+        calculate_receipt([{"name": "Tea", "price": 1, "quantity": 1, "taxRate": rate}])
+
+
+@pytest.mark.parametrize("lines, tax_cents", [(3, 4), (300, 391)])
+def test_group_tax_is_rounded_once_over_many_small_lines(lines, tax_cents):
+    bill = calculate_receipt([{"name": f"Sweet {n}", "price": 0.10, "quantity": 1, "taxRate": 0.15}
+                              for n in range(lines)])
+
+    assert bill['taxes'] == [{"tax_category": "STANDARD", "tax_id": 1, "tax_percent": 15,
+                              "sales_cents": 10 * lines, "tax_cents": tax_cents}]
+    assert bill['tax_cents'] == tax_cents
+    # Per-line tax is kept for information
+    assert [line['tax_cents'] for line in bill['lines']] == [1] * lines
+
+
+def test_groups_are_taxed_separately():
+    bill = calculate_receipt([
+        {"name": "Bread", "price": 0.10, "quantity": 3, "taxRate": 0.15},
+        {"name": "Maize meal", "price": 0.10, "quantity": 3, "taxCategory": "ZERO_RATED"},
+        {"name": "School fees", "price": 5, "quantity": 1, "taxCategory": "EXEMPT"}])
+
+    assert [(g['tax_category'], g['sales_cents'], g['tax_cents']) for g in bill['taxes']] == [
+        ("STANDARD", 30, 4), ("ZERO_RATED", 30, 0), ("EXEMPT", 500, 0)]
+    assert bill['tax_cents'] == 4
+
+
+@pytest.mark.parametrize("category, rate", [("ZERO_RATED", 0.15), ("STANDARD", 0), (None, 0.10)])
+def test_rate_must_match_the_tax_category(category, rate):
+    item = {"name": "Tea", "price": 1, "quantity": 1, "taxRate": rate}
+    if category:
+        item['taxCategory'] = category
+    with pytest.raises(TaxError, match="doesn't match"):
+        calculate_receipt([item])
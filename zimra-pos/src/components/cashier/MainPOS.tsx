@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { 
   Box, 
   Button, 
@@ -66,21 +66,25 @@ const MainPOS: React.FC = () => {
   const [paymentMethod, setPaymentMethod] = useState<'cash' | 'card' | 'mobile'>('cash');
   const [isLoading, setIsLoading] = useState(false);
   const [lastReceipt, setLastReceipt] = useState<any | null>(null); 
+  // One key per sale: retrying after a timeout returns the same receipt
+  const saleKey = useRef<string | null>(null);
 
-  // --- 1. FETCH DEVICE STATUS ON LOAD ---
+  // Any change to the cart makes it a different sale
   useEffect(() => {
-    const fetchStatus = async () => {
-        try {
-            // FIX: Cast to <any> to solve TS18046 error
-            const res = await axios.get<any>('http://localhost:5000/api/device/status');
-            const data = res.data; 
-            setDeviceID(data.deviceID || "UNKNOWN");
-            setIsDayOpen(!!data.is_day_open);
-        } catch (e) {
-            console.error("Failed to fetch device status");
-        }
-    };
-    fetchStatus();
+    saleKey.current = null;
+  }, [cart]);
+
+  // --- 1. FOLLOW DEVICE STATUS (pushed by the backend when the day opens/closes) ---
+  useEffect(() => {
+    const source = new EventSource('http://localhost:5000/api/device/status/stream');
+    source.addEventListener('status', (event) => {
+        const data = JSON.parse((event as MessageEvent).data);
+        setDeviceID(data.deviceID || "UNKNOWN");
+        setIsDayOpen(!!data.is_day_open);
+    });
+    // EventSource reconnects by itself; this only reports the drop
+    source.onerror = () => console.error("Device status stream interrupted");
+    return () => source.close();
   }, []);
 
   // --- FILTERING ---
@@ -165,6 +169,9 @@ const MainPOS: React.FC = () => {
     }
     
     setIsLoading(true);
+    if (!saleKey.current) {
+        saleKey.current = crypto.randomUUID();
+    }
     try {
       // FIX: Cast to <any> to solve TS18046 error
       const response = await axios.post<any>('http://localhost:5000/api/submit-receipt', {
@@ -172,6 +179,8 @@ const MainPOS: React.FC = () => {
         totalAmount: total,
         currency: "USD",
         items: cart 
+      }, {
+        headers: { 'Idempotency-Key': saleKey.current }
       });
 
       const backendData = response.data; // Now safe to use